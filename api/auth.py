@@ -1,14 +1,17 @@
 from datetime import timedelta
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from config import settings
 from core.metrics import LOGIN_ATTEMPTS, REGISTRATIONS_COUNT
-from core.security import create_access_token, verify_password, get_password_hash
+from core.security import create_access_token, create_refresh_token, access_token_claims, decode_token, \
+    averify_password, aget_password_hash, password_needs_rehash, PasswordHashingBusy, REFRESH_TOKEN_TYPE
+from core.user_cache import user_cache
 from db.session import get_db
 from models.user import User
-from schemas.token import Token
+from schemas.token import Token, RefreshRequest
 from schemas.user import UserCreate, UserInDB
 
 router = APIRouter()
@@ -17,11 +20,12 @@ router = APIRouter()
 @router.post("/token", response_model=Token)
 async def login_for_access_token(
         form_data: OAuth2PasswordRequestForm = Depends(),
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_db)
 ):
     """Получение JWT токена"""
-    user = db.query(User).filter(User.username == form_data.username).first()
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    result = await db.execute(select(User).where(User.username == form_data.username))
+    user = result.scalars().first()
+    if not user or not await averify_password(form_data.password, user.hashed_password):
         LOGIN_ATTEMPTS.labels(success='false').inc()
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -29,26 +33,61 @@ async def login_for_access_token(
             headers={"WWW-Authenticate": "Bearer"},
         )
 
+    # Хеш со старым фактором стоимости обновляем, пока пароль известен
+    if password_needs_rehash(user.hashed_password):
+        try:
+            user.hashed_password = await aget_password_hash(form_data.password)
+            await db.commit()
+            user_cache.invalidate(user.username)
+        except PasswordHashingBusy:
+            pass
+
     access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
+        data=access_token_claims(user), expires_delta=access_token_expires
     )
     LOGIN_ATTEMPTS.labels(success='true').inc()
-    return {"access_token": access_token, "token_type": "bearer"}
+    return {"access_token": access_token, "token_type": "bearer", "refresh_token": create_refresh_token(user)}
+
+
+@router.post("/token/refresh", response_model=Token)
+async def refresh_access_token(request: RefreshRequest, db: AsyncSession = Depends(get_db)):
+    """Получение нового токена доступа по токену обновления"""
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    payload = decode_token(request.refresh_token, REFRESH_TOKEN_TYPE)
+    if payload is None:
+        raise credentials_exception
+
+    # Токен обновления проверяется по базе: так отзыв действует сразу во всех процессах
+    user = await db.get(User, payload["uid"])
+    if user is None or not user.is_active or user.token_version != payload.get("ver"):
+        raise credentials_exception
+
+    access_token = create_access_token(
+        data=access_token_claims(user),
+        expires_delta=timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
+    )
+    return {"access_token": access_token, "token_type": "bearer", "refresh_token": request.refresh_token}
 
 
 @router.post("/register", response_model=UserInDB)
-async def register(user: UserCreate, db: Session = Depends(get_db)):
+async def register(user: UserCreate, db: AsyncSession = Depends(get_db)):
     """Регистрация нового пользователя"""
-    db_user = db.query(User).filter(User.username == user.username).first()
+    result = await db.execute(select(User).where(User.username == user.username))
+    db_user = result.scalars().first()
     if db_user:
         raise HTTPException(status_code=400, detail="Username already registered")
 
-    db_user_email = db.query(User).filter(User.email == user.email).first()
+    result = await db.execute(select(User).where(User.email == user.email))
+    db_user_email = result.scalars().first()
     if db_user_email:
         raise HTTPException(status_code=400, detail="Email already registered")
 
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await aget_password_hash(user.password)
     db_user = User(
         username=user.username,
         email=user.email,
@@ -57,8 +96,8 @@ async def register(user: UserCreate, db: Session = Depends(get_db)):
         is_active=True
     )
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     REGISTRATIONS_COUNT.inc()
     return db_user
 
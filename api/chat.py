@@ -1,144 +1,79 @@
-import getpass
-import os
+import json
+import time
 
-from chromadb import Settings, logger
-from dotenv import load_dotenv, find_dotenv
-from fastapi import APIRouter, Depends
-from langchain.chains.retrieval_qa.base import RetrievalQA
-from langchain_chroma import Chroma
-from langchain_gigachat import GigaChat
-from langchain_openai import OpenAIEmbeddings
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 
 from core.deps import get_current_active_user
-from models.user import User
+from core.metrics import CHAT_STREAM_TTFB, CHAT_STREAM_DURATION
+from schemas.token import TokenData
 from schemas.chat import QuestionData, AnswerData
-from config import settings
 
 router = APIRouter()
 
 @router.post("/ask", response_model=AnswerData)
 async def get_answer(
     request: QuestionData,
-    current_user: User = Depends(get_current_active_user)
+    current_user: TokenData = Depends(get_current_active_user)
 ):
-    # Set DB path based on configuration (None when using MongoDB)
-    db_path = None if settings.USE_MONGODB else "DATABASE\\"
-    
-    llm = GigaChat(verify_ssl_certs=False)
-    load_dotenv(find_dotenv())
-
-    if "GIGACHAT_CREDENTIALS" not in os.environ:
-        os.environ["GIGACHAT_CREDENTIALS"] = getpass.getpass("Введите ключ авторизации GigaChat API: ")
+    # LangChain и Chroma импортируются при первом вопросе, а не при запуске
+    from services.embeddings import EmbeddingProviderUnavailable
+    from services.rag_engine import aget_retrieval_engine
 
+    engine = await aget_retrieval_engine()
     try:
-        embeddings = OpenAIEmbeddings()
-
-        if settings.USE_MONGODB:
-            # Use MongoDB for vector search
-            db = Chroma(
-                collection_name="RAG",
-                embedding_function=embeddings,
-                client_settings=Settings(
-                    anonymized_telemetry=False
-                ),
-            )
-        else:
-            db = Chroma(
-                collection_name="RAG",
-                embedding_function=embeddings,
-                client_settings=Settings(
-                    anonymized_telemetry=False,
-                ),
-                persist_directory=db_path
-            )
-            logger.info("Using local Chroma")
-
-        retriever = db.as_retriever(
-            search_type="similarity",
-            search_kwargs={"k": 20}
-        )
-
-        from langchain.prompts import PromptTemplate
-        prompt_template = """ Не используй markdown. Используй только следующий контекст для ответа на вопрос. Если ты не можешь найти ответ в контексте, прямо скажи "Я не могу найти ответ в предоставленных документах".
-        В ответе не должно быть ничего лишнего, только ответ на вопрос без дополнительных указаний.
-
-    Контекст:
-    {context}
-
-    Вопрос: {question}
-    Ответ: """
-        PROMPT = PromptTemplate(
-            template=prompt_template, input_variables=["context", "question"]
-        )
-
-        qa_chain = RetrievalQA.from_chain_type(
-            llm=llm,
-            chain_type="stuff",
-            retriever=retriever,
-            return_source_documents=True,
-            chain_type_kwargs={"prompt": PROMPT}
-        )
-
-        answer = qa_chain({"query": request.question})
-
-        print(f"Использованные документы: {answer['source_documents']}")
+        answer = await engine.aask(request.question, request.k)
+    except EmbeddingProviderUnavailable as e:
+        # Another provider would embed the question into a different space than the index
+        raise HTTPException(status_code=503, detail=str(e))
 
-    except Exception as e:
-        print(f"Ошибка при инициализации OpenAI: {e}")
+    print(f"Использованные документы: {answer['source_documents']}")
 
-        from langchain_huggingface import HuggingFaceEmbeddings
+    return {"question": request.question, "answer": answer["result"]}
 
-        model_name = "jinaai/jina-embeddings-v3"
-        embeddings = HuggingFaceEmbeddings(model_name=model_name, model_kwargs={'trust_remote_code': True})
 
-        if settings.USE_MONGODB:
-            # Use MongoDB for vector search
-            db = Chroma(
-                collection_name="RAG",
-                embedding_function=embeddings,
-                client_settings=Settings(
-                    anonymized_telemetry=False
-                ),
-            )
-        else:
-            db = Chroma(
-                collection_name="RAG",
-                embedding_function=embeddings,
-                client_settings=Settings(
-                    anonymized_telemetry=False,
-                ),
-                persist_directory=db_path
-            )
-            logger.info("Using local Chroma")
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
 
-        retriever = db.as_retriever(
-            search_type="similarity",
-            search_kwargs={"k": 20}
-        )
 
-        from langchain.prompts import PromptTemplate
-        prompt_template = """ Не используй markdown. Используй только следующий контекст для ответа на вопрос. Если ты не можешь найти ответ в контексте, прямо скажи "Я не могу найти ответ в предоставленных документах".
-        В ответе не должно быть ничего лишнего, только ответ на вопрос без дополнительных указаний.
-
-    Контекст:
-    {context}
-
-    Вопрос: {question}
-    Ответ: """
-        PROMPT = PromptTemplate(
-            template=prompt_template, input_variables=["context", "question"]
-        )
-
-        qa_chain = RetrievalQA.from_chain_type(
-            llm=llm,
-            chain_type="stuff",
-            retriever=retriever,
-            return_source_documents=True,
-            chain_type_kwargs={"prompt": PROMPT}
-        )
-
-        answer = qa_chain({"query": request.question})
-
-        print(f"Использованные документы: {answer['source_documents']}")
-
-    return {"question": request.question, "answer": answer["result"]}
\ No newline at end of file
+@router.post("/ask/stream")
+async def stream_answer(
+    request: QuestionData,
+    current_user: TokenData = Depends(get_current_active_user)
+):
+    """Потоковый ответ на вопрос (Server-Sent Events): события token, затем done с источниками"""
+    from services.embeddings import EmbeddingProviderUnavailable
+    from services.rag_engine import aget_retrieval_engine
+
+    start_time = time.perf_counter()
+    engine = await aget_retrieval_engine()
+
+    async def event_stream():
+        first_event = True
+        try:
+            async for event, data in engine.astream(request.question, request.k):
+                if event == "token":
+                    payload = sse_event("token", {"text": data})
+                else:
+                    payload = sse_event("done", {
+                        "question": request.question,
+                        "sources": [doc.metadata for doc in data]
+                    })
+                if first_event:
+                    CHAT_STREAM_TTFB.observe(time.perf_counter() - start_time)
+                    first_event = False
+                yield payload
+        except EmbeddingProviderUnavailable as e:
+            yield sse_event("error", {"detail": str(e)})
+        except Exception as e:
+            # Ошибка LLM посреди потока: клиент должен получить завершающее событие, а не обрыв
+            print(f"Ошибка при потоковой генерации ответа: {e}")
+            yield sse_event("error", {"detail": "Failed to generate an answer"})
+        finally:
+            CHAT_STREAM_DURATION.observe(time.perf_counter() - start_time)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -1,26 +1,33 @@
 import os
+import json
+import base64
+import asyncio
 import aiofiles
-from typing import List, Dict
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, BackgroundTasks
-from sqlalchemy.orm import Session
+from datetime import datetime
+from urllib.parse import quote
+from typing import List, Dict, Optional, Tuple
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, Query
+from fastapi.responses import StreamingResponse
 
 from config import settings
 from core.deps import get_current_admin_user, get_current_active_user
-from db.session import get_db
-from models.user import User
+from schemas.token import TokenData
+from schemas.document import DocumentPage
+from schemas.job import JobSubmitted
+from services.indexing_jobs import enqueue_job, get_job, get_current_job, job_progress
 
-# Импорт функции обработки векторной базы
-# Предполагается, что она у вас уже реализована
-from services.FilesHandler import process_files_to_vector_db, delete_from_vector_db
 from services.mongodb_handler import (
-    save_file_to_mongodb, 
-    get_file_from_mongodb, 
+    save_file_stream_to_mongodb,
+    save_file_streams_to_mongodb,
+    iter_file_chunks_from_mongodb,
+    file_exists_in_mongodb,
     delete_file_from_mongodb, 
-    list_files_from_mongodb
+    list_file_metadata_from_mongodb,
+    count_files_in_mongodb
 )
 from core.metrics import UPDATE_BASE_COUNT, UPLOADED_FILES_COUNT, FILE_SIZE_HISTOGRAM, DELETED_FILES_COUNT, \
     DOCUMENTS_COUNT
-from core.progress import get_progress
+from core.progress import INITIAL_PROGRESS
 
 router = APIRouter()
 
@@ -31,75 +38,201 @@ ALLOWED_DOCUMENT_EXTENSIONS = {
 }
 
 
-@router.get("/update-base", status_code=200)
+@router.get("/update-base", response_model=JobSubmitted, status_code=200)
 async def update_vector_base(
-        background_tasks: BackgroundTasks,
-        current_user: User = Depends(get_current_admin_user)
+        full_rebuild: bool = False,
+        current_user: TokenData = Depends(get_current_admin_user)
 ):
-    """Обновление векторной базы (только для администраторов)"""
-    background_tasks.add_task(process_files_to_vector_db)
+    """
+    Обновление векторной базы (только для администраторов).
+    По умолчанию индексируются только новые и измененные файлы, full_rebuild=true перестраивает базу целиком.
+    Запрос ставит задание в очередь; если задание уже ожидает запуска, запрос объединяется с ним.
+    Состояние задания: GET /api/v1/jobs/{id}.
+    """
+    job, coalesced = await enqueue_job(full_rebuild, requested_by=current_user.username)
     UPDATE_BASE_COUNT.inc()
-    return {"message": "Обработка запущена"}
+    return {"message": "Обработка поставлена в очередь", "job": job, "coalesced": coalesced}
 
 
 @router.get("/update-progress", response_model=Dict, status_code=200)
 async def get_update_progress(
-    current_user: User = Depends(get_current_active_user)
+    job_id: Optional[str] = None,
+    current_user: TokenData = Depends(get_current_active_user)
 ):
-    """Получение статуса прогресса обновления векторной базы (для всех активных пользователей)"""
-    return get_progress()
+    """
+    Получение статуса прогресса обновления векторной базы (для всех активных пользователей).
+    Без job_id возвращается текущее (или последнее) задание. Одинаково для всех процессов API;
+    вместо частого опроса можно подписаться на GET /api/v1/jobs/{job_id}/stream.
+    """
+    job = await get_job(job_id) if job_id else await get_current_job()
+    if job is None:
+        if job_id:
+            raise HTTPException(status_code=404, detail="Задание не найдено")
+        return dict(INITIAL_PROGRESS)
+    return job_progress(job)
+
+
+async def save_file_stream_to_directory(filename, read_chunk):
+    """Сохранение файла в локальную папку по частям; возвращает размер файла"""
+    file_path = os.path.join(settings.DOCS_DIRECTORY, filename)
+    file_size = 0
+    async with aiofiles.open(file_path, "wb") as out_file:
+        while chunk := await read_chunk(settings.UPLOAD_CHUNK_SIZE):
+            file_size += len(chunk)
+            await out_file.write(chunk)
+    return file_size
 
 
 @router.post("/upload", status_code=200)
 async def upload_files(
         files: List[UploadFile],
-        current_user: User = Depends(get_current_admin_user)
+        current_user: TokenData = Depends(get_current_admin_user)
 ):
     """Загрузка документов (только для администраторов)"""
     # Create docs directory for temp files if it doesn't exist
     os.makedirs(settings.DOCS_DIRECTORY, exist_ok=True)
 
     uploaded_files = []
-    for file in files:
-        try:
-            # Check file extension
-            _, file_ext = os.path.splitext(file.filename.lower())
-            if file_ext not in ALLOWED_DOCUMENT_EXTENSIONS:
-                raise HTTPException(
-                    status_code=400, 
-                    detail=f"Неподдерживаемый формат файла: {file_ext}. Разрешены только: {', '.join(ALLOWED_DOCUMENT_EXTENSIONS)}"
-                )
-            
-            # Read file content
-            content = await file.read()
-            file_size = len(content)
-            FILE_SIZE_HISTOGRAM.observe(file_size)
-            
-            if settings.USE_MONGODB:
-                # Save file to MongoDB
-                filename = await save_file_to_mongodb(file.filename, content)
-                uploaded_files.append(filename)
-            else:
-                # Save file to local filesystem (legacy method)
-                file_path = os.path.join(settings.DOCS_DIRECTORY, file.filename)
-                async with aiofiles.open(file_path, "wb") as out_file:
-                    await out_file.write(content)
+    created_files = 0
+    try:
+        for file in files:
+            try:
+                # Check file extension
+                _, file_ext = os.path.splitext(file.filename.lower())
+                if file_ext not in ALLOWED_DOCUMENT_EXTENSIONS:
+                    raise HTTPException(
+                        status_code=400, 
+                        detail=f"Неподдерживаемый формат файла: {file_ext}. Разрешены только: {', '.join(ALLOWED_DOCUMENT_EXTENSIONS)}"
+                    )
+                
+                # Content is streamed in UPLOAD_CHUNK_SIZE blocks, never read whole into memory
+                if settings.USE_MONGODB:
+                    # Save file to MongoDB
+                    file_size, created = await save_file_stream_to_mongodb(file.filename, file.read)
+                else:
+                    # Save file to local filesystem (legacy method)
+                    created = not os.path.exists(os.path.join(settings.DOCS_DIRECTORY, file.filename))
+                    file_size = await save_file_stream_to_directory(file.filename, file.read)
                 uploaded_files.append(file.filename)
-            
-            UPLOADED_FILES_COUNT.inc()
-        except HTTPException as e:
-            # Re-raise HTTP exceptions
-            raise e
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Error uploading file {file.filename}: {str(e)}")
+                FILE_SIZE_HISTOGRAM.observe(file_size)
+                if created:
+                    created_files += 1
+                
+                UPLOADED_FILES_COUNT.inc()
+            except HTTPException as e:
+                # Re-raise HTTP exceptions
+                raise e
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=f"Error uploading file {file.filename}: {str(e)}")
+    finally:
+        # Файлы, сохраненные до ошибки, тоже учитываются
+        await update_documents_count(created_files)
 
     return {"filename": uploaded_files, "result": "OK"}
 
 
+@router.post("/upload/bulk", status_code=200)
+async def upload_files_bulk(
+        files: List[UploadFile],
+        index: bool = False,
+        current_user: TokenData = Depends(get_current_admin_user)
+):
+    """
+    Пакетная загрузка документов (только для администраторов).
+    Файлы записываются параллельно, результат возвращается по каждому файлу.
+    index=true ставит в очередь индексацию только новых и измененных файлов.
+    """
+    os.makedirs(settings.DOCS_DIRECTORY, exist_ok=True)
+
+    # Результат по каждому загруженному файлу в порядке запроса: имена в запросе могут повторяться
+    results = []
+    accepted = {}
+    for file in files:
+        _, file_ext = os.path.splitext(file.filename.lower())
+        if file_ext not in ALLOWED_DOCUMENT_EXTENSIONS:
+            result = {"status": "error", "detail": f"Неподдерживаемый формат файла: {file_ext}"}
+        elif file.filename in accepted:
+            result = {"status": "error", "detail": "Файл с таким именем уже есть в запросе"}
+        else:
+            result = None
+            accepted[file.filename] = (len(results), file)
+        results.append([file.filename, result])
+
+    if settings.USE_MONGODB:
+        saved = await save_file_streams_to_mongodb([(file.filename, file.read) for _, file in accepted.values()])
+    else:
+        semaphore = asyncio.Semaphore(max(1, settings.UPLOAD_CONCURRENCY))
+
+        async def save(file):
+            existed = os.path.exists(os.path.join(settings.DOCS_DIRECTORY, file.filename))
+            try:
+                async with semaphore:
+                    size = await save_file_stream_to_directory(file.filename, file.read)
+            except Exception as e:
+                return file.filename, {"status": "error", "detail": str(e)}
+            return file.filename, {"status": "updated" if existed else "created", "size": size}
+
+        saved = dict(await asyncio.gather(*(save(file) for _, file in accepted.values())))
+    for filename, result in saved.items():
+        results[accepted[filename][0]][1] = result
+
+    changed_files = set()
+    for filename, result in results:
+        if result["status"] in ("created", "updated"):
+            changed_files.add(filename)
+        if result["status"] != "error":
+            FILE_SIZE_HISTOGRAM.observe(result["size"])
+            UPLOADED_FILES_COUNT.inc()
+
+    await update_documents_count(sum(result["status"] == "created" for _, result in results))
+
+    indexing_queued = index and bool(changed_files)
+    job_id = None
+    if indexing_queued:
+        job, _ = await enqueue_job(False, changed_files, requested_by=current_user.username)
+        job_id = job.id
+        UPDATE_BASE_COUNT.inc()
+
+    return {
+        "results": [{"filename": filename, **result} for filename, result in results],
+        "indexing_queued": indexing_queued,
+        "job_id": job_id
+    }
+
+
+@router.get("/{filename}/download")
+async def download_document(
+        filename: str,
+        current_user: TokenData = Depends(get_current_admin_user)
+):
+    """Скачивание документа (только для администраторов)"""
+    if settings.USE_MONGODB:
+        if not await file_exists_in_mongodb(filename):
+            raise HTTPException(status_code=404, detail="File not found")
+        content = iter_file_chunks_from_mongodb(filename)
+    else:
+        file_path = os.path.join(settings.DOCS_DIRECTORY, filename)
+        if not os.path.exists(file_path):
+            raise HTTPException(status_code=404, detail="File not found")
+
+        async def read_file():
+            async with aiofiles.open(file_path, "rb") as f:
+                while chunk := await f.read(settings.UPLOAD_CHUNK_SIZE):
+                    yield chunk
+
+        content = read_file()
+
+    return StreamingResponse(
+        content,
+        media_type="application/octet-stream",
+        headers={"Content-Disposition": f"attachment; filename*=UTF-8''{quote(filename)}"}
+    )
+
+
 @router.delete("/{filename}", status_code=200)
 async def delete_document(
         filename: str,
-        current_user: User = Depends(get_current_admin_user)
+        current_user: TokenData = Depends(get_current_admin_user)
 ):
     """Удаление документа (только для администраторов)"""
     if settings.USE_MONGODB:
@@ -115,26 +248,170 @@ async def delete_document(
         os.remove(file_path)
     
     # Delete from vector database
+    from services.FilesHandler import delete_from_vector_db
+
     await delete_from_vector_db(filename)
         
     DELETED_FILES_COUNT.inc()
+    await update_documents_count(-1)
     return {"message": f"File {filename} deleted successfully"}
 
 
-@router.get("/", response_model=List[str])
+def _encode_cursor(position: Dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(position).encode("utf-8")).decode("ascii")
+
+
+def _decode_cursor(cursor: str, sort_by: str, order: str) -> Tuple:
+    """Позиция (значение поля сортировки, имя файла), после которой начинается страница"""
+    invalid = HTTPException(status_code=400, detail="Некорректный курсор")
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except ValueError:
+        raise invalid
+    if not isinstance(position, dict):
+        raise invalid
+    if position.get("sort_by") != sort_by or position.get("order") != order:
+        raise HTTPException(status_code=400, detail="Курсор получен для другой сортировки")
+
+    value, filename = position.get("value"), position.get("filename")
+    if not isinstance(filename, str):
+        raise invalid
+    if sort_by == "filename":
+        if not isinstance(value, str):
+            raise invalid
+    elif sort_by == "size":
+        if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float))):
+            raise invalid
+    elif value is not None:
+        try:
+            value = datetime.fromisoformat(value)
+        except (TypeError, ValueError):
+            raise invalid
+    return value, filename
+
+
+async def refresh_documents_count():
+    """
+    Пересчет счетчика документов: при старте приложения, а при нескольких процессах API -
+    после загрузки или удаления файлов (см. update_documents_count). В MongoDB число берется из метаданных коллекции,
+    поэтому значение одинаково для всех процессов API.
+    """
+    if settings.USE_MONGODB:
+        count = await count_files_in_mongodb()
+    elif os.path.exists(settings.DOCS_DIRECTORY):
+        count = sum(1 for entry in os.scandir(settings.DOCS_DIRECTORY) if entry.is_file())
+    else:
+        count = 0
+    DOCUMENTS_COUNT.set(count)
+
+
+async def update_documents_count(delta: int) -> None:
+    """
+    Учесть созданные (delta > 0) или удаленные (delta < 0) документы, один раз за запрос.
+    В одном процессе счетчик меняется на delta без обхода хранилища. При нескольких
+    процессах (PROMETHEUS_MULTIPROC_DIR) датчик в режиме mostrecent не поддерживает
+    inc/dec, а значение процесса не видит изменений других, поэтому число пересчитывается.
+    """
+    if not delta:
+        return
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        await refresh_documents_count()
+    else:
+        DOCUMENTS_COUNT.inc(delta)
+
+
+def _directory_sort_key(item: Dict, sort_by: str):
+    value = item[sort_by]
+    # Missing values first, like MongoDB does for ascending order
+    return (value is not None, value if value is not None else 0, item["filename"])
+
+
+def list_file_metadata_from_directory(
+        limit: int,
+        after=None,
+        sort_by: str = "filename",
+        descending: bool = False,
+        extensions=None,
+        min_size: Optional[int] = None,
+        max_size: Optional[int] = None
+):
+    """Страница метаданных файлов из локальной папки; фильтры и сортировка как у MongoDB"""
+    if not os.path.exists(settings.DOCS_DIRECTORY):
+        return [], False
+    items = []
+    for entry in os.scandir(settings.DOCS_DIRECTORY):
+        if not entry.is_file():
+            continue
+        stat = entry.stat()
+        item = {
+            "filename": entry.name,
+            "type": os.path.splitext(entry.name)[1].lower(),
+            "size": stat.st_size,
+            "uploaded_at": datetime.utcfromtimestamp(stat.st_mtime)
+        }
+        if extensions and item["type"] not in extensions:
+            continue
+        if min_size is not None and item["size"] < min_size:
+            continue
+        if max_size is not None and item["size"] > max_size:
+            continue
+        items.append(item)
+
+    items.sort(key=lambda item: _directory_sort_key(item, sort_by), reverse=descending)
+    if after is not None:
+        after_key = _directory_sort_key({sort_by: after[0], "filename": after[1]}, sort_by)
+        items = [
+            item for item in items
+            if (_directory_sort_key(item, sort_by) < after_key if descending
+                else _directory_sort_key(item, sort_by) > after_key)
+        ]
+    return items[:limit], len(items) > limit
+
+
+@router.get("/", response_model=DocumentPage)
 async def list_documents(
-        current_user: User = Depends(get_current_admin_user)
+        limit: int = Query(100, ge=1, le=1000),
+        cursor: Optional[str] = None,
+        sort_by: str = Query("filename", pattern="^(filename|size|uploaded_at)$"),
+        order: str = Query("asc", pattern="^(asc|desc)$"),
+        extension: Optional[List[str]] = Query(None),
+        min_size: Optional[int] = Query(None, ge=0),
+        max_size: Optional[int] = Query(None, ge=0),
+        status: Optional[str] = Query(None, pattern="^(indexed|stale|not_indexed)$"),
+        current_user: TokenData = Depends(get_current_admin_user)
 ):
-    """Получение списка документов (для всех пользователей)"""
+    """
+    Постраничное получение метаданных документов (только для администраторов).
+    Фильтры: extension (можно несколько), min_size/max_size, status индексации.
+    Для следующей страницы передайте next_cursor из ответа с теми же параметрами сортировки.
+    """
+    descending = order == "desc"
+    extensions = {ext.lower() if ext.startswith(".") else f".{ext.lower()}" for ext in extension} if extension else None
+
+    after = None
+    if cursor:
+        after = _decode_cursor(cursor, sort_by, order)
+
     if settings.USE_MONGODB:
-        # Get files from MongoDB
-        files = await list_files_from_mongodb()
+        # Only metadata is read, never the file contents
+        items, has_more = await list_file_metadata_from_mongodb(
+            limit, after, sort_by, descending, extensions, min_size, max_size, status
+        )
     else:
-        # Get files from local filesystem (legacy method)
-        if not os.path.exists(settings.DOCS_DIRECTORY):
-            files = []
-        else:
-            files = os.listdir(settings.DOCS_DIRECTORY)
-            
-    DOCUMENTS_COUNT.set(len(files))
-    return files
\ No newline at end of file
+        if status is not None:
+            raise HTTPException(status_code=400, detail="Фильтр по статусу индексации доступен только при хранении в MongoDB")
+        items, has_more = list_file_metadata_from_directory(
+            limit, after, sort_by, descending, extensions, min_size, max_size
+        )
+
+    next_cursor = None
+    if has_more:
+        last = items[-1]
+        value = last.get(sort_by)
+        next_cursor = _encode_cursor({
+            "sort_by": sort_by,
+            "order": order,
+            "value": value.isoformat() if isinstance(value, datetime) else value,
+            "filename": last["filename"]
+        })
+    return {"items": items, "next_cursor": next_cursor}
@@ -0,0 +1,76 @@
+from typing import List
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+
+from api.chat import sse_event
+from core.deps import get_current_admin_user, get_current_active_user
+from schemas.token import TokenData
+from schemas.job import JobInfo
+from services.indexing_jobs import get_job, list_jobs, cancel_job, job_progress, subscribe_job_progress
+
+router = APIRouter()
+
+
+@router.get("/", response_model=List[JobInfo])
+async def read_jobs(
+        limit: int = Query(20, ge=1, le=100),
+        current_user: TokenData = Depends(get_current_admin_user)
+):
+    """Последние задания индексации (только для администраторов)"""
+    return await list_jobs(limit)
+
+
+@router.get("/{job_id}", response_model=JobInfo)
+async def read_job(
+        job_id: str,
+        current_user: TokenData = Depends(get_current_admin_user)
+):
+    """Состояние задания индексации (только для администраторов)"""
+    job = await get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задание не найдено")
+    return job
+
+
+@router.post("/{job_id}/cancel", response_model=JobInfo)
+async def cancel_indexing_job(
+        job_id: str,
+        current_user: TokenData = Depends(get_current_admin_user)
+):
+    """
+    Отмена задания индексации (только для администраторов).
+    Ожидающее задание отменяется сразу, выполняющееся - обработчиком в течение нескольких секунд.
+    """
+    job = await cancel_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задание не найдено")
+    return job
+
+
+@router.get("/{job_id}/stream")
+async def stream_job_progress(
+        job_id: str,
+        current_user: TokenData = Depends(get_current_active_user)
+):
+    """
+    Прогресс задания индексации (Server-Sent Events, для всех активных пользователей).
+    Событие progress отправляется при изменении, не чаще INDEXING_PROGRESS_INTERVAL_SECONDS,
+    событие done - когда задание завершено. Оба содержат только прогресс: сведения
+    о задании (кто запустил, какие файлы) доступны лишь администраторам.
+    """
+    if await get_job(job_id) is None:
+        raise HTTPException(status_code=404, detail="Задание не найдено")
+
+    async def event_stream():
+        job = None
+        async for job in subscribe_job_progress(job_id):
+            if job is not None:
+                yield sse_event("progress", job_progress(job))
+        if job is not None:
+            yield sse_event("done", job_progress(job))
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
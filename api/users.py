@@ -1,19 +1,39 @@
 from typing import List
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from core.deps import get_current_admin_user, get_current_active_user
-from core.security import get_password_hash
+from core.deps import get_current_admin_user, get_current_active_user, get_current_user
+from core.security import aget_password_hash
+from core.token_revocation import token_revocations, record_revocation
+from core.user_cache import user_cache
 from db.session import get_db
 from models.user import User
+from schemas.token import TokenData
 from schemas.user import UserInDB, UserUpdate
 from config import settings
 
 router = APIRouter()
 
 
-@router.get("/me", response_model=UserInDB)
-async def read_users_me(current_user: User = Depends(get_current_active_user)):
+# Изменения этих полей делают выданные токены недействительными
+TOKEN_AFFECTING_FIELDS = {"username", "hashed_password", "is_admin", "is_active"}
+
+
+def _revoke_tokens(db: AsyncSession, db_user: User) -> None:
+    """Повысить версию токенов пользователя и записать отзыв для других процессов; вызывать до commit"""
+    db_user.token_version = (db_user.token_version or 0) + 1
+    record_revocation(db, db_user.id, db_user.token_version)
+
+
+def _forget_user(db_user: User, *usernames: str) -> None:
+    """Сбросить кэш и отозвать старые токены доступа после commit"""
+    token_revocations.revoke(db_user.id, db_user.token_version)
+    user_cache.invalidate(db_user.username, *usernames)
+
+
+@router.get("/me", response_model=UserInDB, dependencies=[Depends(get_current_active_user)])
+async def read_users_me(current_user: User = Depends(get_current_user)):
     """Получение информации о текущем пользователе"""
     return current_user
 
@@ -22,19 +42,20 @@ async def read_users_me(current_user: User = Depends(get_current_active_user)):
 async def read_users(
         skip: int = 0,
         limit: int = 100,
-        current_user: User = Depends(get_current_admin_user),
-        db: Session = Depends(get_db)
+        current_user: TokenData = Depends(get_current_admin_user),
+        db: AsyncSession = Depends(get_db)
 ):
     """Получение списка пользователей (только для администраторов)"""
-    users = db.query(User).offset(skip).limit(limit).all()
+    result = await db.execute(select(User).offset(skip).limit(limit))
+    users = result.scalars().all()
     return users
 
 
 @router.get("/{user_id}", response_model=UserInDB)
 async def get_user_by_id(
     user_id: int,
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: TokenData = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """Получение информации о пользователе по ID"""
     # Обычные пользователи могут получать информацию только о себе
@@ -44,7 +65,7 @@ async def get_user_by_id(
             detail="Недостаточно прав для получения информации о другом пользователе"
         )
     
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await db.get(User, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
     
@@ -55,56 +76,65 @@ async def get_user_by_id(
 async def update_user(
         user_id: int,
         user_update: UserUpdate,
-        current_user: User = Depends(get_current_admin_user),
-        db: Session = Depends(get_db)
+        current_user: TokenData = Depends(get_current_admin_user),
+        db: AsyncSession = Depends(get_db)
 ):
     """Обновление информации о пользователе (только для администраторов)"""
-    db_user = db.query(User).filter(User.id == user_id).first()
+    db_user = await db.get(User, user_id)
     if not db_user:
         raise HTTPException(status_code=404, detail="User not found")
 
+    previous_username = db_user.username
     update_data = user_update.dict(exclude_unset=True)
     if "password" in update_data:
-        update_data["hashed_password"] = get_password_hash(update_data["password"])
+        update_data["hashed_password"] = await aget_password_hash(update_data["password"])
         del update_data["password"]
 
     for key, value in update_data.items():
         setattr(db_user, key, value)
+    if TOKEN_AFFECTING_FIELDS & update_data.keys():
+        _revoke_tokens(db, db_user)
 
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
+    _forget_user(db_user, previous_username)
     return db_user
 
 
 @router.delete("/{user_id}", status_code=204)
 async def delete_user(
         user_id: int,
-        current_user: User = Depends(get_current_admin_user),
-        db: Session = Depends(get_db)
+        current_user: TokenData = Depends(get_current_admin_user),
+        db: AsyncSession = Depends(get_db)
 ):
     """Удаление пользователя (только для администраторов)"""
-    db_user = db.query(User).filter(User.id == user_id).first()
+    db_user = await db.get(User, user_id)
     if not db_user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    db.delete(db_user)
-    db.commit()
+    _revoke_tokens(db, db_user)
+    await db.delete(db_user)
+    await db.commit()
+    _forget_user(db_user)
     return None
 
 
 @router.post("/admin/reset-password", response_model=UserInDB)
 async def reset_admin_password(
-        current_user: User = Depends(get_current_admin_user),
-        db: Session = Depends(get_db)
+        current_user: TokenData = Depends(get_current_admin_user),
+        db: AsyncSession = Depends(get_db)
 ):
     """Сброс пароля администратора на пароль по умолчанию (только для администраторов)"""
-    admin = db.query(User).filter(User.username == settings.DEFAULT_ADMIN_USERNAME).first()
+    result = await db.execute(select(User).where(User.username == settings.DEFAULT_ADMIN_USERNAME))
+    admin = result.scalars().first()
     if not admin:
         raise HTTPException(status_code=404, detail="Admin user not found")
 
-    admin.hashed_password = get_password_hash(settings.DEFAULT_ADMIN_PASSWORD)
-    db.commit()
-    db.refresh(admin)
+    admin.hashed_password = await aget_password_hash(settings.DEFAULT_ADMIN_PASSWORD)
+    _revoke_tokens(db, admin)
+    await db.commit()
+    await db.refresh(admin)
+    _forget_user(admin)
 
     return admin
 
@@ -112,15 +142,17 @@ async def reset_admin_password(
 async def change_user_password(
     user_id: int,
     password: str,
-    current_user: User = Depends(get_current_admin_user),
-    db: Session = Depends(get_db)
+    current_user: TokenData = Depends(get_current_admin_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """Изменение пароля пользователя (только для администраторов)"""
-    db_user = db.query(User).filter(User.id == user_id).first()
+    db_user = await db.get(User, user_id)
     if not db_user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    db_user.hashed_password = get_password_hash(password)
-    db.commit()
-    db.refresh(db_user)
+    db_user.hashed_password = await aget_password_hash(password)
+    _revoke_tokens(db, db_user)
+    await db.commit()
+    await db.refresh(db_user)
+    _forget_user(db_user)
     return db_user
\ No newline at end of file
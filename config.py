@@ -1,5 +1,6 @@
 import os
 from pathlib import Path
+from typing import Optional
 from pydantic_settings import BaseSettings
 from dotenv import load_dotenv
 
@@ -11,16 +12,37 @@ load_dotenv(dotenv_path=env_path)
 class Settings(BaseSettings):
     # Конфигурация базы данных
     DATABASE_URL: str = os.getenv("POSTGRES_DATABASE_URL_2")
+    # Пул соединений асинхронного движка
+    DATABASE_POOL_SIZE: int = int(os.getenv("DATABASE_POOL_SIZE", "10"))
+    DATABASE_MAX_OVERFLOW: int = int(os.getenv("DATABASE_MAX_OVERFLOW", "20"))
+    DATABASE_POOL_TIMEOUT: float = float(os.getenv("DATABASE_POOL_TIMEOUT", "30"))
+    DATABASE_POOL_RECYCLE: int = int(os.getenv("DATABASE_POOL_RECYCLE", "1800"))
 
     # Конфигурация MongoDB
     MONGODB_URL: str = os.getenv("MONGODB_URL", "mongodb://localhost:27017")
     MONGODB_DB_NAME: str = os.getenv("MONGODB_DB_NAME", "chokofinder")
     MONGODB_COLLECTION_NAME: str = os.getenv("MONGODB_COLLECTION_NAME", "documents")
+    MONGODB_GRIDFS_BUCKET_NAME: str = os.getenv("MONGODB_GRIDFS_BUCKET_NAME", "document_files")
+    # Размер блока при потоковой загрузке и хранении файлов
+    UPLOAD_CHUNK_SIZE: int = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+    # Сколько файлов пакетной загрузки записываются одновременно
+    UPLOAD_CONCURRENCY: int = int(os.getenv("UPLOAD_CONCURRENCY", "8"))
 
     # Конфигурация JWT
     SECRET_KEY: str = os.getenv("SECRET_KEY")
     ALGORITHM: str = os.getenv("ALGORITHM", "HS256")
-    ACCESS_TOKEN_EXPIRE_MINUTES: int = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "1440"))  
+    ACCESS_TOKEN_EXPIRE_MINUTES: int = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "15"))
+    REFRESH_TOKEN_EXPIRE_DAYS: int = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "7"))
+    # Как часто процесс API забирает отзывы токенов, сделанные другими процессами
+    TOKEN_REVOCATION_POLL_SECONDS: float = float(os.getenv("TOKEN_REVOCATION_POLL_SECONDS", "2"))
+    # Хеширование паролей
+    BCRYPT_ROUNDS: int = int(os.getenv("BCRYPT_ROUNDS", "12"))
+    PASSWORD_HASH_WORKERS: int = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+    PASSWORD_HASH_MAX_QUEUE: int = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "64"))
+
+    # Кэш пользователей, прошедших аутентификацию (0 - отключен)
+    USER_CACHE_TTL_SECONDS: float = float(os.getenv("USER_CACHE_TTL_SECONDS", "60"))
+    USER_CACHE_MAX_SIZE: int = int(os.getenv("USER_CACHE_MAX_SIZE", "10000"))
 
     # Конфигурация приложения
     DOCS_DIRECTORY: str = os.getenv("DOCS_DIRECTORY", "Docs")
@@ -33,11 +55,68 @@ class Settings(BaseSettings):
     CHUNK_SIZE: int = os.getenv("CHUNK_SIZE", "512")
     CHUNK_OVERLAP: int = os.getenv("CHUNK_OVERLAP", "50")
 
+    # Разбор документов в отдельных процессах
+    PARSE_WORKERS: int = int(os.getenv("PARSE_WORKERS", str(os.cpu_count() or 1)))
+    PARSE_TIMEOUT_SECONDS: float = float(os.getenv("PARSE_TIMEOUT_SECONDS", "300"))
+
+    # Создание эмбеддингов при индексации
+    EMBEDDING_BATCH_SIZE: int = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+    EMBEDDING_CONCURRENCY: int = int(os.getenv("EMBEDDING_CONCURRENCY", "4"))
+    EMBEDDING_REQUESTS_PER_MINUTE: float = float(os.getenv("EMBEDDING_REQUESTS_PER_MINUTE", "300"))
+    EMBEDDING_MAX_RETRIES: int = int(os.getenv("EMBEDDING_MAX_RETRIES", "5"))
+    EMBEDDING_RETRY_BASE_DELAY: float = float(os.getenv("EMBEDDING_RETRY_BASE_DELAY", "1"))
+
     CHROMA_DB_PATH: str = os.getenv("CHROMA_DB_PATH", "DATABASE\\")
+    # Сервер Chroma; нужен, чтобы API и отдельный обработчик индексации работали с одной базой
+    CHROMA_SERVER_HOST: Optional[str] = os.getenv("CHROMA_SERVER_HOST") or None
+    CHROMA_SERVER_PORT: int = int(os.getenv("CHROMA_SERVER_PORT", "8000"))
+
+    # Задания индексации: embedded - выполняются в процессе API, external - отдельным процессом
+    # (python -m services.indexing_worker)
+    INDEXING_WORKER_MODE: str = os.getenv("INDEXING_WORKER_MODE", "embedded")
+    INDEXING_JOB_POLL_SECONDS: float = float(os.getenv("INDEXING_JOB_POLL_SECONDS", "2"))
+    # Как часто прогресс задания записывается в хранилище и отправляется клиентам
+    INDEXING_PROGRESS_INTERVAL_SECONDS: float = float(os.getenv("INDEXING_PROGRESS_INTERVAL_SECONDS", "1"))
+    # Задание без отметки обработчика дольше этого времени считается прерванным и ставится в очередь снова
+    INDEXING_JOB_STALE_SECONDS: float = float(os.getenv("INDEXING_JOB_STALE_SECONDS", "60"))
     USE_MONGODB: bool = os.getenv("USE_MONGODB", "True").lower() == "true"
 
+    # Конфигурация RAG
+    RAG_SEARCH_WORKERS: int = int(os.getenv("RAG_SEARCH_WORKERS", "4"))
+    # Сколько фрагментов попадает в контекст; в запросе можно указать свое k, но не больше RAG_MAX_K
+    RAG_TOP_K: int = int(os.getenv("RAG_TOP_K", "20"))
+    RAG_MAX_K: int = int(os.getenv("RAG_MAX_K", "50"))
+    # similarity - ближайшие фрагменты, mmr - ближайшие с учетом разнообразия (из RAG_FETCH_K кандидатов)
+    RAG_SEARCH_TYPE: str = os.getenv("RAG_SEARCH_TYPE", "similarity")
+    RAG_FETCH_K: int = int(os.getenv("RAG_FETCH_K", "40"))
+    # 1 - только релевантность, 0 - только разнообразие
+    RAG_MMR_LAMBDA: float = float(os.getenv("RAG_MMR_LAMBDA", "0.5"))
+    # Минимальное косинусное сходство фрагмента с вопросом; не задан - фрагменты не отсекаются
+    RAG_SCORE_THRESHOLD: Optional[float] = (
+        float(os.getenv("RAG_SCORE_THRESHOLD")) if os.getenv("RAG_SCORE_THRESHOLD") else None
+    )
+    # Ограничение размера контекста в токенах; 0 - без ограничения
+    RAG_CONTEXT_TOKEN_BUDGET: int = int(os.getenv("RAG_CONTEXT_TOKEN_BUDGET", "3000"))
+
+    # Кэш ответов
+    ANSWER_CACHE_ENABLED: bool = os.getenv("ANSWER_CACHE_ENABLED", "True").lower() == "true"
+    ANSWER_CACHE_MAX_SIZE: int = int(os.getenv("ANSWER_CACHE_MAX_SIZE", "1024"))
+    ANSWER_CACHE_TTL_SECONDS: float = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600"))
+    # Порог косинусного сходства для поиска похожих вопросов; не задан - поиск отключен
+    ANSWER_CACHE_SIMILARITY_THRESHOLD: Optional[float] = (
+        float(os.getenv("ANSWER_CACHE_SIMILARITY_THRESHOLD")) if os.getenv("ANSWER_CACHE_SIMILARITY_THRESHOLD") else None
+    )
+
     # OpenAI configuration
     OPENAI_API_KEY: str = os.getenv("OPENAI_API_KEY")
+    OPENAI_EMBEDDINGS_TIMEOUT: float = float(os.getenv("OPENAI_EMBEDDINGS_TIMEOUT", "10"))
+    OPENAI_EMBEDDINGS_MAX_RETRIES: int = int(os.getenv("OPENAI_EMBEDDINGS_MAX_RETRIES", "1"))
+    OPENAI_CIRCUIT_FAILURE_THRESHOLD: int = int(os.getenv("OPENAI_CIRCUIT_FAILURE_THRESHOLD", "3"))
+    OPENAI_CIRCUIT_RESET_SECONDS: float = float(os.getenv("OPENAI_CIRCUIT_RESET_SECONDS", "60"))
+
+    # Локальная модель эмбеддингов (резервная)
+    LOCAL_EMBEDDINGS_MODEL: str = os.getenv("LOCAL_EMBEDDINGS_MODEL", "jinaai/jina-embeddings-v3")
+    LOCAL_EMBEDDINGS_PRELOAD: bool = os.getenv("LOCAL_EMBEDDINGS_PRELOAD", "False").lower() == "true"
 
     class Config:
         case_sensitive = True
@@ -1,49 +1,70 @@
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from jose import JWTError, jwt
-from sqlalchemy.orm import Session
-from config import settings
-from db.session import get_db
+from sqlalchemy import select
+from core.security import decode_token, ACCESS_TOKEN_TYPE
+from core.token_revocation import token_revocations
+from core.user_cache import user_cache
+from db.session import AsyncSessionLocal
 from models.user import User
 from schemas.token import TokenData
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
-#TODO: refresh token
 
-async def get_current_user(
-        token: str = Depends(oauth2_scheme),
-        db: Session = Depends(get_db)
-):
-    """Получение текущего пользователя по JWT токену"""
+
+async def get_token_data(token: str = Depends(oauth2_scheme)) -> TokenData:
+    """Проверка токена доступа; данные для авторизации берутся из самого токена"""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-        token_data = TokenData(username=username)
-    except JWTError:
+    payload = decode_token(token, ACCESS_TOKEN_TYPE)
+    if payload is None:
         raise credentials_exception
-
-    user = db.query(User).filter(User.username == token_data.username).first()
-    if user is None:
+    token_data = TokenData(
+        username=payload["sub"],
+        id=payload["uid"],
+        is_admin=payload.get("adm", False),
+        is_active=payload.get("act", False),
+        token_version=payload.get("ver", 0)
+    )
+    if token_revocations.is_revoked(token_data.id, token_data.token_version):
         raise credentials_exception
+    return token_data
+
+
+async def get_current_user(token_data: TokenData = Depends(get_token_data)):
+    """Получение текущего пользователя по JWT токену (полная запись, нужна не для авторизации)"""
+    user = user_cache.get(token_data.username)
+    if user is not None:
+        return user
+
+    # Сессия открывается только при промахе кэша
+    version = user_cache.version
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(select(User).where(User.username == token_data.username))
+        user = result.scalars().first()
+        if user is None:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Could not validate credentials",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        # Отсоединяем от сессии: объект переживет запрос и будет использоваться из кэша
+        db.expunge(user)
+    user_cache.put(user.username, user, version)
     return user
 
 
-async def get_current_active_user(current_user: User = Depends(get_current_user)):
+async def get_current_active_user(current_user: TokenData = Depends(get_token_data)):
     """Проверка, что пользователь активен"""
     if not current_user.is_active:
         raise HTTPException(status_code=400, detail="Inactive user")
     return current_user
 
 
-async def get_current_admin_user(current_user: User = Depends(get_current_active_user)):
+async def get_current_admin_user(current_user: TokenData = Depends(get_current_active_user)):
     """Проверка, что пользователь является администратором"""
     if not current_user.is_admin:
         raise HTTPException(status_code=403, detail="Not enough permissions")
-    return current_user
\ No newline at end of file
+    return current_user
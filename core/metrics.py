@@ -1,8 +1,10 @@
+import os
 import time
 
-from prometheus_client import Counter, Gauge, Histogram, generate_latest
-from starlette.middleware.base import BaseHTTPMiddleware
-from fastapi import Request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+)
+from starlette.responses import Response
 
 REQUEST_COUNT = Counter(
     'http_requests_total',
@@ -10,11 +12,14 @@ REQUEST_COUNT = Counter(
     ['method', 'endpoint', 'status_code']
 )
 
+# Ответы чата занимают десятки секунд, поэтому верхние корзины доходят до двух минут
+LLM_LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+
 RESPONSE_TIME = Histogram(
     'http_response_time_seconds',
     'HTTP response time in seconds',
     ['method', 'endpoint'],
-    buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 2.0, 5.0)
+    buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0, 120.0)
 )
 
 HTTP_ERRORS = Counter(
@@ -46,7 +51,8 @@ DELETED_FILES_COUNT = Counter(
 
 DOCUMENTS_COUNT = Gauge(
     'documents_total',
-    'Total number of documents'
+    'Total number of documents',
+    multiprocess_mode='mostrecent'
 )
 
 LOGIN_ATTEMPTS = Counter(
@@ -60,20 +66,181 @@ REGISTRATIONS_COUNT = Counter(
     'Total number of user registrations'
 )
 
-class MetricsMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        start_time = time.time()
-        response = await call_next(request)
-        process_time = time.time() - start_time
-        method = request.method
-        endpoint = request.url.path
-        status_code = response.status_code
+EMBEDDING_PROVIDER_FAILURES = Counter(
+    'embedding_provider_failures_total',
+    'Total failed calls to an embedding provider',
+    ['provider']
+)
+
+EMBEDDING_CIRCUIT_OPEN = Gauge(
+    'embedding_circuit_open',
+    'Whether the circuit breaker of an embedding provider is open',
+    ['provider'],
+    multiprocess_mode='livemax'
+)
+
+ANSWER_CACHE_HITS = Counter(
+    'answer_cache_hits_total',
+    'Total chat answers served from the cache',
+    ['layer']
+)
+
+ANSWER_CACHE_MISSES = Counter(
+    'answer_cache_misses_total',
+    'Total chat questions not found in the cache'
+)
+
+RAG_STAGE_DURATION = Histogram(
+    'rag_stage_duration_seconds',
+    'Duration of each stage of answering a chat question',
+    ['stage'],
+    buckets=(0.005, 0.01, 0.025, 0.05) + LLM_LATENCY_BUCKETS
+)
+
+RAG_RETRIEVED_CHUNKS = Histogram(
+    'rag_retrieved_chunks',
+    'Number of candidate chunks returned by the vector search for a question',
+    buckets=(0, 1, 2, 5, 10, 20, 50)
+)
+
+RAG_CONTEXT_CHUNKS = Histogram(
+    'rag_context_chunks',
+    'Number of passages sent to the LLM after filtering, deduplication and the token budget',
+    buckets=(0, 1, 2, 5, 10, 20, 50)
+)
+
+RAG_CONTEXT_TOKENS = Histogram(
+    'rag_context_tokens',
+    'Estimated size of the context sent to the LLM in tokens',
+    buckets=(0, 250, 500, 1000, 2000, 4000, 8000, 16000)
+)
+
+RAG_CONTEXT_DROPPED = Counter(
+    'rag_context_dropped_chunks_total',
+    'Retrieved chunks left out of the context',
+    ['reason']
+)
+
+RAG_PROMPT_TOKENS = Histogram(
+    'rag_prompt_tokens',
+    'Prompt size sent to the LLM in tokens (reported by the LLM, or estimated)',
+    buckets=(250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+)
+
+RAG_FALLBACKS = Counter(
+    'rag_fallbacks_total',
+    'Chat questions answered on a degraded path',
+    ['reason']
+)
+
+CHAT_STREAM_TTFB = Histogram(
+    'chat_stream_time_to_first_byte_seconds',
+    'Time from a streaming chat request to its first event',
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0)
+)
+
+CHAT_STREAM_DURATION = Histogram(
+    'chat_stream_duration_seconds',
+    'Total time to stream a chat answer',
+    buckets=(0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+)
+
+USER_CACHE_HITS = Counter(
+    'user_cache_hits_total',
+    'Total authenticated requests served without a user lookup'
+)
+
+USER_CACHE_MISSES = Counter(
+    'user_cache_misses_total',
+    'Total authenticated requests that loaded the user from the database'
+)
+
+PASSWORD_HASH_QUEUE_DEPTH = Gauge(
+    'password_hash_queue_depth',
+    'Password hashing and verification jobs waiting for a worker',
+    multiprocess_mode='livesum'
+)
+
+DB_POOL_CHECKOUT_TIME = Histogram(
+    'db_pool_checkout_seconds',
+    'Time spent waiting for a database connection from the pool',
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)
+)
+
+DB_POOL_CHECKED_OUT = Gauge(
+    'db_pool_checked_out_connections',
+    'Database connections currently checked out of the pool',
+    multiprocess_mode='livesum'
+)
+
+DB_POOL_CAPACITY = Gauge(
+    'db_pool_capacity_connections',
+    'Maximum number of database connections the pool may open (size + overflow)',
+    multiprocess_mode='livesum'
+)
+
+STARTUP_PHASE_SECONDS = Gauge(
+    'startup_phase_seconds',
+    'Duration of each application startup phase in seconds',
+    ['phase'],
+    multiprocess_mode='max'
+)
+
+# Запросы, не совпавшие ни с одним маршрутом, объединяются в одну серию
+UNMATCHED_ROUTE = "<unmatched>"
+
+
+def route_template(scope):
+    """Шаблон маршрута FastAPI (например, /api/v1/documents/{filename}) вместо фактического пути"""
+    route = scope.get("route")
+    return getattr(route, "path", None) or UNMATCHED_ROUTE
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware метрик HTTP. Метки - шаблон маршрута, а не путь запроса,
+    поэтому число серий ограничено числом маршрутов.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start_time = time.perf_counter()
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            process_time = time.perf_counter() - start_time
+            method = scope["method"]
+            # Маршрут записывается в scope при маршрутизации
+            endpoint = route_template(scope)
 
-        REQUEST_COUNT.labels(method, endpoint, status_code).inc()
-        RESPONSE_TIME.labels(method, endpoint).observe(process_time)
-        if status_code >= 400:
-            HTTP_ERRORS.labels(method, endpoint, status_code).inc()
+            REQUEST_COUNT.labels(method, endpoint, status_code).inc()
+            RESPONSE_TIME.labels(method, endpoint).observe(process_time)
+            if status_code >= 400:
+                HTTP_ERRORS.labels(method, endpoint, status_code).inc()
 
-        return response
 
-# Добавление middleware в приложение
+def metrics_response():
+    """
+    Ответ для /metrics. Если задан PROMETHEUS_MULTIPROC_DIR (несколько процессов uvicorn/gunicorn),
+    метрики собираются из файлов всех процессов.
+    """
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
@@ -1,8 +1,12 @@
+import copy
+import time
+from contextlib import contextmanager
+from datetime import datetime
 from typing import Dict, Optional
 from threading import Lock
 
-# Глобальный объект для хранения статуса прогресса
-progress_data = {
+# Начальное состояние прогресса
+INITIAL_PROGRESS = {
     "is_processing": False,
     "total_files": 0,
     "processed_files": 0,
@@ -10,16 +14,42 @@ progress_data = {
     "processed_documents": 0,
     "current_stage": "",
     "percent_complete": 0,
-    "error": None
+    "error": None,
+    # Этапы обработки: время начала и длительность в секундах
+    "stages": {},
+    # Скорость обработки: файлы, фрагменты и эмбеддинги в секунду
+    "throughput": {}
 }
 
+# Прогресс задания, выполняемого в этом процессе.
+# Другим процессам он передается через хранилище заданий (services.indexing_jobs)
+progress_data = copy.deepcopy(INITIAL_PROGRESS)
+
 
 progress_lock = Lock()
 
 def get_progress() -> Dict:
     """Получить текущий статус прогресса"""
     with progress_lock:
-        return progress_data.copy()
+        return copy.deepcopy(progress_data)
+
+def reset_progress() -> None:
+    """Сбросить прогресс перед запуском нового задания"""
+    with progress_lock:
+        progress_data.clear()
+        progress_data.update(copy.deepcopy(INITIAL_PROGRESS))
+
+@contextmanager
+def progress_stage(name: str):
+    """Замер длительности этапа обработки"""
+    started = time.perf_counter()
+    with progress_lock:
+        progress_data["stages"][name] = {"started_at": datetime.utcnow().isoformat(), "seconds": None}
+    try:
+        yield
+    finally:
+        with progress_lock:
+            progress_data["stages"][name]["seconds"] = round(time.perf_counter() - started, 3)
 
 def update_progress(
     is_processing: Optional[bool] = None,
@@ -29,10 +59,14 @@ def update_progress(
     processed_documents: Optional[int] = None,
     current_stage: Optional[str] = None,
     error: Optional[str] = None,
-    percent_complete: Optional[int] = None
+    percent_complete: Optional[int] = None,
+    throughput: Optional[Dict] = None
 ) -> None:
     """Обновить статус прогресса"""
     with progress_lock:
+        if throughput is not None:
+            progress_data["throughput"] = throughput
+
         if is_processing is not None:
             progress_data["is_processing"] = is_processing
         
@@ -64,4 +98,4 @@ def update_progress(
         
         if error is not None:
             progress_data["error"] = error
-            progress_data["is_processing"] = False 
\ No newline at end of file
+            progress_data["is_processing"] = False
@@ -1,8 +1,16 @@
+import asyncio
+import threading
 import bcrypt
 import jwt
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Optional
 from config import settings
+from core.metrics import PASSWORD_HASH_QUEUE_DEPTH
+
+
+class PasswordHashingBusy(Exception):
+    """Очередь задач хеширования паролей переполнена"""
 
 
 def verify_password(plain_password, hashed_password):
@@ -19,11 +27,75 @@ def get_password_hash(password):
     """Хеширование пароля"""
     if isinstance(password, str):
         password = password.encode('utf-8')
-    salt = bcrypt.gensalt()
+    salt = bcrypt.gensalt(rounds=settings.BCRYPT_ROUNDS)
     hashed = bcrypt.hashpw(password, salt)
     return hashed.decode('utf-8')
 
 
+def password_needs_rehash(hashed_password):
+    """Хеш создан с другим фактором стоимости, чем настроен сейчас"""
+    try:
+        rounds = int(hashed_password.split("$")[2])
+    except (AttributeError, IndexError, ValueError):
+        return True
+    return rounds != settings.BCRYPT_ROUNDS
+
+
+# bcrypt отпускает GIL, поэтому хватает потоков; пул ограничивает число одновременных хеширований
+_hash_executor = ThreadPoolExecutor(max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+_hash_queue_lock = threading.Lock()
+_hash_queue_depth = 0
+
+
+def _change_queue_depth(delta):
+    global _hash_queue_depth
+    with _hash_queue_lock:
+        _hash_queue_depth += delta
+        PASSWORD_HASH_QUEUE_DEPTH.set(_hash_queue_depth)
+        return _hash_queue_depth
+
+
+async def _run_in_hash_pool(func, *args):
+    # Ожидающие задачи считаются до запуска в потоке, а не на время самого хеширования
+    if _change_queue_depth(1) > settings.PASSWORD_HASH_MAX_QUEUE:
+        _change_queue_depth(-1)
+        raise PasswordHashingBusy()
+
+    def run():
+        _change_queue_depth(-1)
+        return func(*args)
+
+    future = _hash_executor.submit(run)
+    # Задача, отмененная до запуска (клиент ушел), тоже покидает очередь
+    future.add_done_callback(lambda f: f.cancelled() and _change_queue_depth(-1))
+    return await asyncio.wrap_future(future)
+
+
+async def averify_password(plain_password, hashed_password):
+    """Проверка пароля в пуле хеширования, не блокируя цикл событий"""
+    return await _run_in_hash_pool(verify_password, plain_password, hashed_password)
+
+
+async def aget_password_hash(password):
+    """Хеширование пароля в пуле хеширования, не блокируя цикл событий"""
+    return await _run_in_hash_pool(get_password_hash, password)
+
+
+ACCESS_TOKEN_TYPE = "access"
+REFRESH_TOKEN_TYPE = "refresh"
+
+
+def access_token_claims(user) -> dict:
+    """Данные пользователя, нужные для авторизации без обращения к базе"""
+    return {
+        "sub": user.username,
+        "uid": user.id,
+        "adm": bool(user.is_admin),
+        "act": bool(user.is_active),
+        "ver": user.token_version or 0
+    }
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """Создание JWT токена"""
     to_encode = data.copy()
@@ -31,6 +103,30 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
         expire = datetime.utcnow() + expires_delta
     else:
         expire = datetime.utcnow() + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "type": ACCESS_TOKEN_TYPE})
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
-    return encoded_jwt
\ No newline at end of file
+    return encoded_jwt
+
+
+def create_refresh_token(user):
+    """Создание долгоживущего токена обновления"""
+    expire = datetime.utcnow() + timedelta(days=settings.REFRESH_TOKEN_EXPIRE_DAYS)
+    to_encode = {
+        "sub": user.username,
+        "uid": user.id,
+        "ver": user.token_version or 0,
+        "exp": expire,
+        "type": REFRESH_TOKEN_TYPE
+    }
+    return jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
+
+
+def decode_token(token: str, token_type: str) -> Optional[dict]:
+    """Проверка подписи, срока и типа токена; None, если токен недействителен"""
+    try:
+        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+    except jwt.PyJWTError:
+        return None
+    if payload.get("type") != token_type or payload.get("sub") is None or payload.get("uid") is None:
+        return None
+    return payload
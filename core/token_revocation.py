@@ -0,0 +1,88 @@
+import time
+import asyncio
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, delete
+
+from config import settings
+from db.session import AsyncSessionLocal
+from models.token_revocation import TokenRevocation
+
+
+class TokenRevocations:
+    """
+    Компактный набор отзывов токенов доступа: для пользователя хранится только
+    минимальная действительная версия токена. Запись живет не дольше срока
+    действия токена доступа - после этого все отозванные токены и так истекли.
+    Отзывы других процессов API приходят через таблицу token_revocations
+    (watch_token_revocations); токены обновления проверяются по базе.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._min_versions = {}
+        self._lock = threading.Lock()
+
+    def revoke(self, user_id, min_version):
+        """Отозвать все токены пользователя с версией меньше min_version"""
+        now = time.monotonic()
+        expires_at = now + self.ttl
+        with self._lock:
+            # Отзывы редки, поэтому устаревшие записи чистим здесь же
+            expired = [key for key, entry in self._min_versions.items() if entry[1] <= now]
+            for key in expired:
+                del self._min_versions[key]
+            current = self._min_versions.get(user_id)
+            if current is not None and current[0] > min_version:
+                min_version = current[0]
+            self._min_versions[user_id] = (min_version, expires_at)
+
+    def is_revoked(self, user_id, version):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._min_versions.get(user_id)
+            if entry is None:
+                return False
+            if entry[1] <= now:
+                del self._min_versions[user_id]
+                return False
+            return version < entry[0]
+
+
+token_revocations = TokenRevocations(ttl=settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+
+
+def record_revocation(db, user_id, min_version):
+    """Добавить отзыв в текущую транзакцию, чтобы его увидели остальные процессы API"""
+    db.add(TokenRevocation(user_id=user_id, min_version=min_version, revoked_at=datetime.utcnow()))
+
+
+async def sync_token_revocations():
+    """Применить отзывы, которые еще могут касаться действующих токенов, и удалить старые"""
+    window_start = datetime.utcnow() - timedelta(seconds=token_revocations.ttl)
+    async with AsyncSessionLocal() as db:
+        async with db.begin():
+            # Отзывов мало, поэтому читаются все актуальные: повторное применение ничего не меняет,
+            # а транзакции, зафиксированные не по порядку времени, не теряются
+            result = await db.execute(
+                select(TokenRevocation.user_id, TokenRevocation.min_version)
+                .where(TokenRevocation.revoked_at >= window_start)
+            )
+            revocations = result.all()
+            await db.execute(delete(TokenRevocation).where(TokenRevocation.revoked_at < window_start))
+    for user_id, min_version in revocations:
+        token_revocations.revoke(user_id, min_version)
+
+
+async def watch_token_revocations(stop_event):
+    """Опрос отзывов токенов, сделанных в других процессах API"""
+    while not stop_event.is_set():
+        try:
+            await sync_token_revocations()
+        except Exception as e:
+            print(f"Failed to poll token revocations: {e}")
+        try:
+            await asyncio.wait_for(stop_event.wait(), timeout=settings.TOKEN_REVOCATION_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
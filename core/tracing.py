@@ -0,0 +1,31 @@
+from contextlib import contextmanager
+
+# OpenTelemetry необязателен: без него спаны не создаются, а без настроенного
+# экспортера его трассировщик ничего не записывает
+try:
+    from opentelemetry import trace
+except ImportError:
+    trace = None
+
+_tracer = trace.get_tracer("chokofinder") if trace is not None else None
+
+
+@contextmanager
+def span(name: str, current: bool = True, **attributes):
+    """
+    Спан трассировки на время блока.
+    current=False не делает спан текущим - нужно внутри асинхронных генераторов,
+    которые могут продолжаться в другом контексте.
+    """
+    if _tracer is None:
+        yield None
+        return
+    if current:
+        with _tracer.start_as_current_span(name, attributes=attributes) as active:
+            yield active
+    else:
+        inactive = _tracer.start_span(name, attributes=attributes)
+        try:
+            yield inactive
+        finally:
+            inactive.end()
@@ -0,0 +1,67 @@
+import time
+import threading
+from collections import OrderedDict
+
+from config import settings
+from core.metrics import USER_CACHE_HITS, USER_CACHE_MISSES
+
+
+class UserCache:
+    """
+    Кэш аутентифицированных пользователей с TTL, ключ - имя пользователя.
+    Хранит объекты User, отсоединенные от сессии, чтобы запросы с токеном
+    не обращались к базе. После изменения пользователя нужно вызвать invalidate().
+    Между процессами кэш не общий: там устаревание ограничено TTL.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._version = 0
+        self._lock = threading.Lock()
+
+    @property
+    def version(self):
+        """Версия кэша; передается в put(), чтобы не сохранить пользователя, прочитанного до изменения"""
+        return self._version
+
+    def get(self, username):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(username)
+                USER_CACHE_HITS.inc()
+                return entry[0]
+            if entry is not None:
+                del self._entries[username]
+        USER_CACHE_MISSES.inc()
+        return None
+
+    def put(self, username, user, version=None):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            if version is not None and version != self._version:
+                return
+            self._entries[username] = (user, time.monotonic() + self.ttl)
+            self._entries.move_to_end(username)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, *usernames):
+        """Удалить пользователей из кэша (без аргументов - очистить весь кэш)"""
+        with self._lock:
+            if usernames:
+                for username in usernames:
+                    self._entries.pop(username, None)
+            else:
+                self._entries.clear()
+            self._version += 1
+
+
+user_cache = UserCache(
+    max_size=settings.USER_CACHE_MAX_SIZE,
+    ttl=settings.USER_CACHE_TTL_SECONDS
+)
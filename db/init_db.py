@@ -1,6 +1,8 @@
 import logging
-from sqlalchemy.orm import Session
-from core.security import get_password_hash
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from core.security import aget_password_hash, averify_password, password_needs_rehash
+from core.token_revocation import record_revocation
 from models.user import User
 from config import settings
 
@@ -14,12 +16,25 @@ DEFAULT_ADMIN_EMAIL = "admin@example.com"
 DEFAULT_ADMIN_PASSWORD = "admin123"
 
 
-def init_db(db: Session) -> None:
+# Столбцы, добавленные после создания таблиц: create_all не меняет существующие таблицы
+SCHEMA_UPGRADES = (
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS token_version INTEGER NOT NULL DEFAULT 0",
+)
+
+
+def upgrade_schema(connection) -> None:
+    """Добавление недостающих столбцов в существующие таблицы"""
+    for statement in SCHEMA_UPGRADES:
+        connection.execute(text(statement))
+
+
+async def init_db(db: AsyncSession) -> None:
     """Инициализация базы данных с созданием администратора по умолчанию или обновлением пароля"""
     admin_username = getattr(settings, "DEFAULT_ADMIN_USERNAME", DEFAULT_ADMIN_USERNAME)
     admin_email = getattr(settings, "DEFAULT_ADMIN_EMAIL", DEFAULT_ADMIN_EMAIL)
     admin_password = getattr(settings, "DEFAULT_ADMIN_PASSWORD", DEFAULT_ADMIN_PASSWORD)
-    user = db.query(User).filter(User.username == admin_username).first()
+    result = await db.execute(select(User).where(User.username == admin_username))
+    user = result.scalars().first()
 
     if not user:
         logger.info("Создание администратора по умолчанию")
@@ -27,20 +42,29 @@ def init_db(db: Session) -> None:
         admin = User(
             username=admin_username,
             email=admin_email,
-            hashed_password=get_password_hash(admin_password),
+            hashed_password=await aget_password_hash(admin_password),
             is_admin=True,
             is_active=True
         )
 
         db.add(admin)
-        db.commit()
+        await db.commit()
 
         logger.info(f"Администратор создан: username={admin_username}, email={admin_email}")
     else:
-        logger.info("Администратор уже существует, обновляем пароль.")
-        user.hashed_password = get_password_hash(admin_password)
-        db.commit()
-        logger.info(f"Пароль администратора обновлен для пользователя: {admin_username}")
+        # Проверка пароля дешевле записи и не отзывает токены администратора при каждом запуске
+        password_changed = not await averify_password(admin_password, user.hashed_password)
+        if password_changed or password_needs_rehash(user.hashed_password):
+            logger.info("Администратор уже существует, обновляем пароль.")
+            user.hashed_password = await aget_password_hash(admin_password)
+            if password_changed:
+                # Смена пароля делает выданные администратору токены недействительными
+                user.token_version = (user.token_version or 0) + 1
+                record_revocation(db, user.id, user.token_version)
+            await db.commit()
+            logger.info(f"Пароль администратора обновлен для пользователя: {admin_username}")
+        else:
+            logger.info("Администратор уже существует, пароль не изменился.")
 
     if DEFAULT_ADMIN_PASSWORD == admin_password:
         logger.warning(
@@ -1,37 +1,64 @@
+import time
 import logging
-from sqlalchemy import create_engine, text
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.exc import OperationalError
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 
 from config import settings
+from core.metrics import DB_POOL_CHECKOUT_TIME, DB_POOL_CHECKED_OUT, DB_POOL_CAPACITY
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def get_engine():
-    """Создает и возвращает движок SQLAlchemy"""
-    logger.info(f"Попытка подключения к базе данных с URL: {settings.DATABASE_URL}")
-    try:
-        engine = create_engine(
-            settings.DATABASE_URL,
-        )
-        with engine.connect() as conn:
-            result = conn.execute(text("SELECT current_database(), current_user, version()"))
-            row = result.fetchone()
-            logger.info(f"Подключение успешно. База данных: {row[0]}, пользователь: {row[1]}, версия: {row[2]}")
-        return engine
-    except Exception as e:
-        logger.error(f"Ошибка подключения к базе данных типа {type(e).__name__}: {str(e)}")
-        raise
-
-engine = get_engine()
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-
-def get_db():
-    """Зависимость для получения сессии базы данных"""
-    db = SessionLocal()
-    try:
+class _InstrumentedPool(AsyncAdaptedQueuePool):
+    """Пул соединений, замеряющий время ожидания свободного соединения"""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            DB_POOL_CHECKOUT_TIME.observe(time.perf_counter() - started)
+
+
+def get_async_database_url():
+    """URL базы данных с асинхронным драйвером asyncpg"""
+    return make_url(settings.DATABASE_URL).set(drivername="postgresql+asyncpg")
+
+
+def get_async_engine():
+    """
+    Создает асинхронный движок SQLAlchemy с явно настроенным пулом.
+    Соединения открываются лениво, при первом запросе к базе.
+    """
+    async_engine = create_async_engine(
+        get_async_database_url(),
+        poolclass=_InstrumentedPool,
+        pool_size=settings.DATABASE_POOL_SIZE,
+        max_overflow=settings.DATABASE_MAX_OVERFLOW,
+        pool_timeout=settings.DATABASE_POOL_TIMEOUT,
+        pool_recycle=settings.DATABASE_POOL_RECYCLE,
+        pool_pre_ping=True,
+    )
+    DB_POOL_CAPACITY.set(settings.DATABASE_POOL_SIZE + settings.DATABASE_MAX_OVERFLOW)
+
+    @event.listens_for(async_engine.sync_engine, "checkout")
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        DB_POOL_CHECKED_OUT.inc()
+
+    @event.listens_for(async_engine.sync_engine, "checkin")
+    def on_checkin(dbapi_connection, connection_record):
+        DB_POOL_CHECKED_OUT.dec()
+
+    return async_engine
+
+
+async_engine = get_async_engine()
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+async def get_db():
+    """Зависимость для получения асинхронной сессии базы данных"""
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
\ No newline at end of file
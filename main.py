@@ -1,27 +1,112 @@
+import time
+
+# Время запуска считается с начала импорта приложения
+_import_started = time.perf_counter()
+
 import os
+import sys
+import asyncio
 import logging
-from fastapi import FastAPI
+from contextlib import asynccontextmanager, contextmanager
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.exc import OperationalError
 from sqlalchemy import text
 
 from api import api_router
 from config import settings
-from core.metrics import MetricsMiddleware
+from core.metrics import MetricsMiddleware, STARTUP_PHASE_SECONDS, metrics_response
+from core.security import PasswordHashingBusy
+from core.token_revocation import watch_token_revocations
 from db.base import Base
-from db.session import engine, SessionLocal
-from db.init_db import init_db
+from db.session import async_engine, AsyncSessionLocal
+from db.init_db import init_db, upgrade_schema
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+@contextmanager
+def startup_phase(name):
+    """Замер длительности этапа запуска; ошибка этапа не останавливает приложение"""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        logger.error(f"Этап запуска '{name}' завершился ошибкой: {e}")
+    finally:
+        elapsed = time.perf_counter() - started
+        STARTUP_PHASE_SECONDS.labels(name).set(elapsed)
+        logger.info(f"Этап запуска '{name}': {elapsed:.3f} с")
+
+
+# Инициализация базы данных
+async def setup_db():
+    # Создание таблиц
+    async with async_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(upgrade_schema)
+    logger.info("Таблицы в базе данных успешно созданы")
+
+    # Инициализация начальных данных
+    async with AsyncSessionLocal() as db:
+        await init_db(db)
+
+
+def warm_up_embeddings():
+    # Загружаем локальную модель эмбеддингов заранее, чтобы не делать этого в запросе
+    from services.embeddings import warm_up_local_embeddings
+    warm_up_local_embeddings()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    started = time.perf_counter()
+    with startup_phase("database"):
+        await setup_db()
+    if settings.USE_MONGODB:
+        with startup_phase("mongodb_indexes"):
+            from services.mongodb_handler import ensure_mongodb_indexes
+            await ensure_mongodb_indexes()
+    with startup_phase("documents_count"):
+        from api.documents import refresh_documents_count
+        await refresh_documents_count()
+    # Задания индексации: результат применяется в каждом процессе API, выполнение - в одном обработчике
+    from services.indexing_jobs import watch_finished_jobs
+    stop_event = asyncio.Event()
+    background = [
+        asyncio.create_task(watch_finished_jobs(stop_event)),
+        # Отзывы токенов из других процессов API
+        asyncio.create_task(watch_token_revocations(stop_event))
+    ]
+    if settings.INDEXING_WORKER_MODE == "embedded":
+        from services.indexing_worker import run_worker
+        background.append(asyncio.create_task(run_worker(stop_event)))
+    if settings.LOCAL_EMBEDDINGS_PRELOAD:
+        # Модель загружается в фоне и не задерживает готовность приложения
+        asyncio.get_running_loop().run_in_executor(None, warm_up_embeddings)
+    logger.info(f"Приложение запущено за {time.perf_counter() - started:.3f} с")
+
+    yield
+
+    stop_event.set()
+    for task in background:
+        task.cancel()
+    await asyncio.gather(*background, return_exceptions=True)
+    await async_engine.dispose()
+    # Пул разбора документов есть, только если документы разбирались
+    document_loaders = sys.modules.get("services.document_loaders")
+    if document_loaders is not None:
+        document_loaders.shutdown_parse_pool()
+
+
 # Создание приложения FastAPI
 app = FastAPI(
     title="RAG Agent API",
     description="API для работы с RAG агентом",
     version="0.1.0",
-    debug=settings.DEBUG
+    debug=settings.DEBUG,
+    lifespan=lifespan
 )
 
 # Настройка CORS
@@ -34,47 +119,36 @@ app.add_middleware(
 )
 
 
-# Инициализация базы данных
-def setup_db():
-    try:
-        # Создание таблиц
-        Base.metadata.create_all(bind=engine)
-        logger.info("Таблицы в базе данных успешно созданы")
-
-        # Инициализация начальных данных
-        db = SessionLocal()
-        try:
-            init_db(db)
-        finally:
-            db.close()
-
-    except OperationalError as e:
-        logger.error(f"Не удалось инициализировать базу данных: {e}")
-        if settings.DEBUG:
-            logger.warning("Режим отладки: продолжаем работу")
-        else:
-            logger.error("Критическая ошибка: приложение не может запуститься без базы данных")
-            import sys
-            sys.exit(1)
+@app.exception_handler(PasswordHashingBusy)
+async def password_hashing_busy_handler(request: Request, exc: PasswordHashingBusy):
+    # Очередь хеширования переполнена: просим клиента повторить позже
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Too many concurrent authentication requests, try again later"},
+        headers={"Retry-After": "1"},
+    )
 
 
-
-setup_db()
-
 app.include_router(api_router)
 app.add_middleware(MetricsMiddleware)
 
 os.makedirs(settings.DOCS_DIRECTORY, exist_ok=True)
 
+STARTUP_PHASE_SECONDS.labels("imports").set(time.perf_counter() - _import_started)
+
 @app.get("/")
 async def root():
     return {"message": "Welcome to RAG Agent API"}
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return metrics_response()
+
 @app.get("/health")
 async def health_check():
     try:
-        with engine.connect() as conn:
-            conn.execute(text("SELECT 1"))
+        async with async_engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
         return {"status": "healthy", "database": "connected"}
     except Exception as e:
         return {"status": "unhealthy", "database": str(e)}
@@ -82,6 +156,5 @@ async def health_check():
 
 if __name__ == "__main__":
     import uvicorn
-    from prometheus_client import start_http_server
+    # Метрики отдаются приложением на /metrics
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
-    start_http_server(8010)
\ No newline at end of file
@@ -0,0 +1,45 @@
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text, JSON, Index, text
+from db.base import Base
+
+# Состояния задания индексации
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+
+class IndexingJob(Base):
+    __tablename__ = "indexing_jobs"
+
+    id = Column(String(32), primary_key=True)
+    status = Column(String(16), nullable=False, index=True)
+    full_rebuild = Column(Boolean, nullable=False, default=False)
+    # None - все файлы, иначе только перечисленные
+    filenames = Column(JSON, nullable=True)
+    requested_by = Column(String, nullable=True)
+    # Сколько запросов объединено в это задание
+    requests = Column(Integer, nullable=False, default=1)
+    cancel_requested = Column(Boolean, nullable=False, default=False)
+    created_at = Column(DateTime, nullable=False)
+    started_at = Column(DateTime, nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)
+    # Выдается обработчику при захвате задания; записи без него не принимаются
+    claim_token = Column(String(32), nullable=True)
+    finished_at = Column(DateTime, nullable=True, index=True)
+    error = Column(Text, nullable=True)
+    result = Column(JSON, nullable=True)
+    # Последний снимок прогресса, записанный обработчиком
+    progress = Column(JSON, nullable=True)
+
+    # В очереди не больше одного задания: новые запросы объединяются с ним.
+    # Выполняется тоже не больше одного: второй захват нарушает индекс и откатывается
+    __table_args__ = (
+        Index(
+            "ix_indexing_jobs_single_queued", "status",
+            unique=True, postgresql_where=text(f"status = '{JOB_QUEUED}'")
+        ),
+        Index(
+            "ix_indexing_jobs_single_running", "status",
+            unique=True, postgresql_where=text(f"status = '{JOB_RUNNING}'")
+        ),
+    )
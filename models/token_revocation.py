@@ -0,0 +1,13 @@
+from sqlalchemy import Column, Integer, DateTime
+from db.base import Base
+
+class TokenRevocation(Base):
+    """Отзыв токенов доступа, общий для всех процессов API"""
+    __tablename__ = "token_revocations"
+
+    id = Column(Integer, primary_key=True)
+    # Без внешнего ключа: отзыв должен пережить удаление пользователя
+    user_id = Column(Integer, nullable=False)
+    # Токены с версией меньше этой недействительны
+    min_version = Column(Integer, nullable=False)
+    revoked_at = Column(DateTime, nullable=False, index=True)
@@ -9,4 +9,6 @@ class User(Base):
     email = Column(String, unique=True, index=True)
     hashed_password = Column(String)
     is_admin = Column(Boolean, default=False)
-    is_active = Column(Boolean, default=True)
\ No newline at end of file
+    is_active = Column(Boolean, default=True)
+    # Увеличивается при изменениях, которые должны сделать выданные токены недействительными
+    token_version = Column(Integer, nullable=False, default=0, server_default="0")
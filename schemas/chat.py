@@ -1,7 +1,13 @@
-from pydantic import BaseModel
+from typing import Optional
+
+from pydantic import BaseModel, Field
+
+from config import settings
 
 class QuestionData(BaseModel):
     question: str
+    # Число фрагментов контекста; по умолчанию RAG_TOP_K
+    k: Optional[int] = Field(None, ge=1, le=settings.RAG_MAX_K)
 
 class AnswerData(BaseModel):
     question: str
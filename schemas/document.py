@@ -0,0 +1,15 @@
+from datetime import datetime
+from typing import List, Optional
+from pydantic import BaseModel
+
+class DocumentInfo(BaseModel):
+    filename: str
+    type: Optional[str] = None
+    size: Optional[int] = None
+    content_hash: Optional[str] = None
+    uploaded_at: Optional[datetime] = None
+    indexed_at: Optional[datetime] = None
+
+class DocumentPage(BaseModel):
+    items: List[DocumentInfo]
+    next_cursor: Optional[str] = None
@@ -0,0 +1,27 @@
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from pydantic import BaseModel
+
+class JobInfo(BaseModel):
+    id: str
+    status: str
+    full_rebuild: bool
+    filenames: Optional[List[str]] = None
+    requested_by: Optional[str] = None
+    requests: int
+    cancel_requested: bool
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    error: Optional[str] = None
+    result: Optional[Dict[str, Any]] = None
+    progress: Optional[Dict[str, Any]] = None
+
+    class Config:
+        from_attributes = True
+
+class JobSubmitted(BaseModel):
+    message: str
+    job: JobInfo
+    # Запрос объединен с уже ожидающим заданием
+    coalesced: bool
@@ -1,94 +1,76 @@
 import os
-import getpass
-from glob import glob
+import json
+import time
+import hashlib
+import functools
+from glob import iglob
 import asyncio
 import pathlib
 
-from dotenv import load_dotenv, find_dotenv
-from langchain_chroma import Chroma
-from langchain_community.document_loaders import (
-    PyPDFLoader,
-    TextLoader,
-    Docx2txtLoader,
-    UnstructuredHTMLLoader,
-    UnstructuredMarkdownLoader,
-    UnstructuredRTFLoader,
-    UnstructuredODTLoader
-)
+import aiofiles
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from chromadb.config import Settings
-from langchain.chains import RetrievalQA
-from langchain_openai import OpenAIEmbeddings
-from langchain_gigachat.chat_models import GigaChat
 from config import settings
-from core.progress import update_progress
-from services.mongodb_handler import get_file_from_mongodb, list_files_from_mongodb, get_temp_file_path
-
-# Store the vector database in MongoDB or local directory based on settings
-db_path = "DATABASE\\" if not settings.USE_MONGODB else None
-
-# Список разрешенных форматов документов (должен совпадать с api/documents.py)
-ALLOWED_DOCUMENT_EXTENSIONS = {
-    '.pdf', '.txt', '.docx', '.doc', '.rtf', '.md', '.markdown', 
-    '.odt', '.tex', '.html', '.htm'
-}
-
-# Map file extensions to appropriate document loaders
-DOCUMENT_LOADERS = {
-    '.pdf': PyPDFLoader,
-    '.txt': TextLoader,
-    '.docx': Docx2txtLoader,
-    '.doc': Docx2txtLoader,  # Note: Requires antiword for .doc files
-    '.rtf': UnstructuredRTFLoader,
-    '.md': UnstructuredMarkdownLoader,
-    '.markdown': UnstructuredMarkdownLoader,
-    '.odt': UnstructuredODTLoader,
-    '.html': UnstructuredHTMLLoader,
-    '.htm': UnstructuredHTMLLoader,
-    '.tex': TextLoader,
-}
+from core.progress import update_progress, progress_stage
+from services.mongodb_handler import (
+    get_file_from_mongodb,
+    iter_file_hashes_from_mongodb,
+    set_file_hash_in_mongodb,
+    mark_file_indexed_in_mongodb
+)
+from services.answer_cache import answer_cache
+from services.document_loaders import ALLOWED_DOCUMENT_EXTENSIONS, DOCUMENT_LOADERS, parse_document
+from services.embedding_pipeline import BatchEmbedder
+from services.embeddings import (
+    get_embeddings,
+    get_collection_provider,
+    select_indexing_provider,
+    PROVIDER_LOCAL,
+    PROVIDER_METADATA_KEY
+)
+from services.vector_store import (
+    open_vector_store,
+    drop_collection,
+    promote_staging_collection,
+    STAGING_COLLECTION_NAME
+)
+
+# Bumped whenever the chunk metadata/id scheme changes; older collections get a full rebuild
+INDEX_FORMAT_VERSION = 2
+INDEX_FORMAT_METADATA_KEY = "index_format"
+# Files that produced no chunks (scans, empty documents) have no row to carry their hash,
+# so their hashes are kept in the collection metadata as a JSON object
+EMPTY_FILES_METADATA_KEY = "empty_files"
+
+
+class SourceFile:
+    """A document to index: its name in the index, local path (filesystem mode) and content hash if known"""
+
+    def __init__(self, name, path=None, content_hash=None):
+        self.name = name
+        self.path = path
+        self.content_hash = content_hash
+
 
 async def delete_from_vector_db(filename: str) -> bool:
     """Delete document from vector database by its filename"""
     try:
-        embeddings = OpenAIEmbeddings()
-        
-        # Setup Chroma DB with appropriate configuration
-        if settings.USE_MONGODB:
-            db = Chroma(
-                collection_name="RAG",
-                embedding_function=embeddings,
-                client_settings=Settings(anonymized_telemetry=False),
-                # When using MongoDB with Chroma, we don't specify persist_directory
-            )
-        else:
-            db = Chroma(
-                collection_name="RAG",
-                embedding_function=embeddings,
-                client_settings=Settings(anonymized_telemetry=False),
-                persist_directory=db_path
-            )
-        
-        # Get all documents from the collection
-        result = db.get()
+        db = open_vector_store(None)
+        # Chunks carry the normalized file name, so the lookup goes through Chroma's metadata index
+        # and only touches the chunks of this file
+        where = {"filename": os.path.basename(filename)}
         
-        # Find documents with source path containing the filename
-        # Chroma stores document sources in the metadata
-        ids_to_delete = []
-        if result and result.get('metadatas'):
-            for i, metadata in enumerate(result['metadatas']):
-                if metadata and 'source' in metadata:
-                    # Check if the source path contains our filename
-                    source = metadata['source']
-                    if os.path.basename(source) == filename or filename in source:
-                        ids_to_delete.append(result['ids'][i])
+        result = await asyncio.to_thread(db._collection.get, where=where, include=[])
+        ids_to_delete = result["ids"]
         
         # Delete the matching documents
         if ids_to_delete:
-            db._collection.delete(ids=ids_to_delete)
+            await asyncio.to_thread(db._collection.delete, ids=ids_to_delete)
+            answer_cache.invalidate()
             print(f"Deleted {len(ids_to_delete)} document chunks from vector database for file {filename}")
             return True
         else:
+            if not is_current_index(db):
+                print("Vector database predates per-file metadata, run tools/migrate_vector_metadata.py or a full rebuild")
             print(f"No documents found in vector database for file {filename}")
             return False
             
@@ -96,7 +78,314 @@ async def delete_from_vector_db(filename: str) -> bool:
         print(f"Error deleting from vector DB: {str(e)}")
         return False
 
-async def process_files_to_vector_db():
+
+def compute_content_hash(content):
+    return hashlib.sha256(content).hexdigest()
+
+
+def chunk_id(filename, content_hash, chunk_index):
+    """Deterministic chunk id: re-indexing the same content upserts the same ids"""
+    return hashlib.sha256(f"{filename}:{content_hash}:{chunk_index}".encode("utf-8")).hexdigest()
+
+
+def is_current_index(db):
+    metadata = db._collection.metadata or {}
+    return metadata.get(INDEX_FORMAT_METADATA_KEY) == INDEX_FORMAT_VERSION
+
+
+def get_empty_files(db):
+    """Content hash of every indexed file that produced no chunks"""
+    metadata = db._collection.metadata or {}
+    return json.loads(metadata.get(EMPTY_FILES_METADATA_KEY, "{}"))
+
+
+def save_empty_files(db, empty_files):
+    metadata = dict(db._collection.metadata or {})
+    metadata[EMPTY_FILES_METADATA_KEY] = json.dumps(empty_files, ensure_ascii=False, sort_keys=True)
+    db._collection.modify(metadata=metadata)
+
+
+def get_indexed_files(db):
+    """Content hash of every file in the index, read from the first chunk of each file"""
+    result = db._collection.get(where={"chunk_index": 0}, include=["metadatas"])
+    indexed = get_empty_files(db)
+    indexed.update({metadata["filename"]: metadata["content_hash"] for metadata in result["metadatas"]})
+    return indexed
+
+
+async def iter_source_files(filenames=None):
+    """Stream the documents that should be in the index, optionally only the given ones"""
+    if settings.USE_MONGODB:
+        async for filename, content_hash in iter_file_hashes_from_mongodb(filenames):
+            if pathlib.Path(filename).suffix.lower() in ALLOWED_DOCUMENT_EXTENSIONS:
+                yield SourceFile(filename, content_hash=content_hash)
+        return
+    for ext in ALLOWED_DOCUMENT_EXTENSIONS:
+        for path in iglob(os.path.join(settings.DOCS_DIRECTORY, f"*{ext}")):
+            if filenames is None or os.path.basename(path) in filenames:
+                yield SourceFile(os.path.basename(path), path=path)
+
+
+async def read_source_file(source):
+    """Raw content of a document, None if it no longer exists"""
+    if settings.USE_MONGODB:
+        return await get_file_from_mongodb(source.name)
+    try:
+        async with aiofiles.open(source.path, "rb") as f:
+            return await f.read()
+    except FileNotFoundError:
+        return None
+
+
+async def load_source_file(source, content):
+    if settings.USE_MONGODB:
+        # Parsed straight from the bytes read from MongoDB
+        return await parse_document(source.name, content=content)
+    return await parse_document(source.name, path=source.path)
+
+
+async def prepare_source_file(source, indexed):
+    """Read, hash and parse a file; returns None when it does not need (re)indexing"""
+    file_ext = pathlib.Path(source.name).suffix.lower()
+    if file_ext not in DOCUMENT_LOADERS:
+        update_progress(current_stage=f"Формат файла {file_ext} не поддерживается")
+        return None
+
+    content = await read_source_file(source)
+    if content is None:
+        update_progress(current_stage=f"Файл {source.name} не найден")
+        return None
+
+    content_hash = compute_content_hash(content)
+    if settings.USE_MONGODB and source.content_hash != content_hash:
+        # Files uploaded before hashes were stored get theirs on first indexing
+        await set_file_hash_in_mongodb(source.name, content_hash)
+    source.content_hash = content_hash
+
+    if indexed.get(source.name) == content_hash:
+        return None
+    return await load_source_file(source, content)
+
+
+def iter_chunks(source, documents, text_splitter):
+    """Split a file page by page into (id, chunk) pairs tagged with their file, content hash and position"""
+    chunk_index = 0
+    for page_index, document in enumerate(documents):
+        # start_index (added by the splitter) and page_index let retrieval join neighbouring chunks exactly
+        for chunk in text_splitter.split_documents([document]):
+            chunk.metadata.update(
+                filename=source.name,
+                content_hash=source.content_hash,
+                chunk_index=chunk_index,
+                page_index=page_index
+            )
+            yield chunk_id(source.name, source.content_hash, chunk_index), chunk
+            chunk_index += 1
+
+
+def remove_stale_chunks(db, filename, content_hash):
+    """Remove chunks of older versions of a file"""
+    db._collection.delete(where={"$and": [
+        {"filename": filename},
+        {"content_hash": {"$ne": content_hash}}
+    ]})
+
+
+def remove_files(db, filenames):
+    db._collection.delete(where={"filename": {"$in": list(filenames)}})
+
+
+def open_staging_collection(provider):
+    """
+    Staging collection for a full rebuild. One left behind by an interrupted
+    rebuild with the same provider is resumed instead of started over.
+    """
+    staging = open_vector_store(None, STAGING_COLLECTION_NAME)
+    if not is_current_index(staging) or get_collection_provider(staging) != provider:
+        drop_collection(staging, STAGING_COLLECTION_NAME)
+    return open_vector_store(
+        get_embeddings(provider),
+        STAGING_COLLECTION_NAME,
+        collection_metadata={
+            PROVIDER_METADATA_KEY: provider,
+            INDEX_FORMAT_METADATA_KEY: INDEX_FORMAT_VERSION
+        }
+    )
+
+
+def open_live_collection(provider):
+    return open_vector_store(get_embeddings(provider))
+
+
+# Marks the end of a pipeline queue
+_DONE = object()
+
+
+class IndexingPipeline:
+    """
+    Streaming ingestion into one collection:
+    source files -> PARSE_WORKERS parsers -> page-by-page chunking -> BatchEmbedder.
+    Stages hand over through bounded queues, so memory stays flat however large the corpus is.
+    """
+
+    def __init__(self, db, indexed):
+        self.db = db
+        self.indexed = indexed
+        self.text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=settings.CHUNK_SIZE,
+            chunk_overlap=settings.CHUNK_OVERLAP,
+            add_start_index=True,
+        )
+        self.embedder = BatchEmbedder(db, db.embeddings, on_progress=self._report_progress)
+        self.workers = max(1, settings.PARSE_WORKERS)
+        # Names of all source files, needed to find files deleted since the last run
+        self.seen_files = set()
+        self.discovered_files = 0
+        self.processed_files = 0
+        self.changed_files = 0
+        self.total_chunks = 0
+        # Indexed files: content hash if the file produced no chunks, None otherwise
+        self.empty_files = {}
+        self._discovery_error = None
+        self._started = None
+
+    async def run(self, sources):
+        self._started = time.perf_counter()
+        candidates = asyncio.Queue(maxsize=self.workers)
+        parsed = asyncio.Queue(maxsize=self.workers)
+        tasks = [asyncio.create_task(self._discover(sources, candidates))]
+        tasks += [asyncio.create_task(self._parse(candidates, parsed)) for _ in range(self.workers)]
+        try:
+            finished_workers = 0
+            while finished_workers < self.workers:
+                item = await parsed.get()
+                if item is _DONE:
+                    finished_workers += 1
+                    continue
+                await self._index(*item)
+            await self.embedder.flush()
+            if self._discovery_error is not None:
+                # An incomplete file list must not be used to decide what was deleted
+                raise self._discovery_error
+        finally:
+            for task in tasks:
+                task.cancel()
+            await self.embedder.close()
+
+    async def _discover(self, sources, candidates):
+        try:
+            async for source in sources:
+                self.seen_files.add(source.name)
+                # Files whose stored hash matches the index are skipped without being read
+                if source.content_hash is not None and self.indexed.get(source.name) == source.content_hash:
+                    continue
+                self.discovered_files += 1
+                await candidates.put(source)
+        except Exception as e:
+            self._discovery_error = e
+        for _ in range(self.workers):
+            await candidates.put(_DONE)
+
+    async def _parse(self, candidates, parsed):
+        while (source := await candidates.get()) is not _DONE:
+            try:
+                documents = await prepare_source_file(source, self.indexed)
+            except Exception as e:
+                print(f"Error loading {source.name}: {e}")
+                update_progress(current_stage=f"Ошибка при загрузке файла {source.name}: {str(e)}")
+                documents = None
+            await parsed.put((source, documents))
+        await parsed.put(_DONE)
+
+    async def _index(self, source, documents):
+        self.processed_files += 1
+        self._report_progress()
+        if documents is None:
+            return
+
+        update_progress(current_stage=f"Индексация файла: {source.name}")
+        self.changed_files += 1
+        self.embedder.begin_file(source.name)
+        file_chunks = 0
+        # Splitting a large file takes long enough to stall other requests, so it runs in a thread
+        chunks = await asyncio.to_thread(lambda: list(iter_chunks(source, documents, self.text_splitter)))
+        for chunk_id, chunk in chunks:
+            self.total_chunks += 1
+            file_chunks += 1
+            await self.embedder.add_chunk(source.name, chunk_id, chunk)
+        await self.embedder.end_file(source.name, functools.partial(self._file_indexed, source, file_chunks))
+
+    async def _file_indexed(self, source, file_chunks):
+        self.empty_files[source.name] = None if file_chunks else source.content_hash
+        # Older versions of the file (and leftovers of interrupted runs) go once the new one is stored
+        await asyncio.to_thread(remove_stale_chunks, self.db, source.name, source.content_hash)
+        if settings.USE_MONGODB:
+            await mark_file_indexed_in_mongodb(source.name, source.content_hash)
+
+    def _report_progress(self, *_):
+        # First half of the bar is parsing, second half embedding
+        files_part = self.processed_files / self.discovered_files if self.discovered_files else 0
+        chunks_part = self.embedder.stored_chunks / self.total_chunks if self.total_chunks else 0
+        elapsed = time.perf_counter() - self._started if self._started is not None else 0
+        update_progress(
+            total_files=self.discovered_files,
+            processed_files=self.processed_files,
+            total_documents=self.total_chunks,
+            processed_documents=self.embedder.stored_chunks,
+            percent_complete=int(50 * files_part + 50 * chunks_part),
+            throughput={
+                "files_per_second": round(self.processed_files / elapsed, 2) if elapsed else 0,
+                "chunks_per_second": round(self.total_chunks / elapsed, 2) if elapsed else 0,
+                "embeddings_per_second": round(self.embedder.embedded_chunks / elapsed, 2) if elapsed else 0
+            }
+        )
+
+
+async def sync_collection(provider, full_rebuild, filenames=None):
+    """
+    Bring a collection in line with the source files: the live one, or the
+    staging one for a full rebuild. When filenames is given only those files
+    are looked at, and no file is treated as deleted.
+    Returns the collection, the number of changed files, the removed files and the chunk count.
+    """
+    with progress_stage("scan"):
+        # Opening may load (or download) the local embedding model, so it stays off the event loop
+        db = await asyncio.to_thread(open_staging_collection if full_rebuild else open_live_collection, provider)
+        indexed = await asyncio.to_thread(get_indexed_files, db)
+    update_progress(
+        total_files=0,
+        total_documents=0,
+        current_stage="Полная перестройка векторной базы" if full_rebuild else "Обновление векторной базы"
+    )
+
+    pipeline = IndexingPipeline(db, indexed)
+    with progress_stage("indexing"):
+        await pipeline.run(iter_source_files(filenames))
+
+    removed_files = set(indexed) - pipeline.seen_files if filenames is None else set()
+    if removed_files:
+        with progress_stage("cleanup"):
+            await asyncio.to_thread(remove_files, db, removed_files)
+
+    empty_files = await asyncio.to_thread(get_empty_files, db)
+    updated = {**empty_files, **pipeline.empty_files}
+    updated = {name: content_hash for name, content_hash in updated.items()
+               if content_hash is not None and name not in removed_files}
+    if updated != empty_files:
+        await asyncio.to_thread(save_empty_files, db, updated)
+    return db, pipeline.changed_files, removed_files, pipeline.total_chunks
+
+
+async def process_files_to_vector_db(full_rebuild=False, filenames=None):
+    """
+    Bring the vector base in line with the stored documents.
+    Only new and changed files are embedded and chunks of changed or deleted
+    files are removed. A full rebuild is done on request or when the live
+    collection predates the current index format.
+    filenames limits an incremental run to those files (e.g. just uploaded ones).
+    Returns a summary of the run; the API processes use it to drop cached answers
+    and switch to a promoted collection. Errors are recorded in the progress and re-raised.
+    """
     try:
         # Устанавливаем начальный статус
         update_progress(
@@ -106,140 +395,57 @@ async def process_files_to_vector_db():
             processed_documents=0,
             percent_complete=0
         )
-        
-        # If using MongoDB, get files from there, otherwise use filesystem
-        if settings.USE_MONGODB:
-            # Get list of files from MongoDB
-            files_list = await list_files_from_mongodb()
-            # Filter by allowed extensions
-            doc_files = [f for f in files_list if pathlib.Path(f).suffix.lower() in ALLOWED_DOCUMENT_EXTENSIONS]
-            update_progress(total_files=len(doc_files), current_stage="Загрузка документов из MongoDB")
-        else:
-            directory = "Docs\\"
-            doc_files = []
-            for ext in ALLOWED_DOCUMENT_EXTENSIONS:
-                doc_files.extend(glob(os.path.join(directory, f"*{ext}")))
-            update_progress(total_files=len(doc_files), current_stage="Загрузка документов из локальной папки")
-        
-        documents = []
-        processed_files = 0
-        
-        for filename in doc_files:
-            try:
-                # Get file extension to determine the loader
-                file_ext = pathlib.Path(filename).suffix.lower()
-                
-                # Skip if extension not supported by loaders
-                if file_ext not in DOCUMENT_LOADERS:
-                    update_progress(current_stage=f"Формат файла {file_ext} не поддерживается")
-                    continue
-                
-                # Get the appropriate loader class
-                loader_class = DOCUMENT_LOADERS[file_ext]
-                
-                # Handle files differently based on storage location
-                if settings.USE_MONGODB:
-                    # Get file content from MongoDB and save to temp file
-                    file_content = await get_file_from_mongodb(filename)
-                    if file_content:
-                        temp_file_path = await get_temp_file_path(filename, file_content)
-                        loader = loader_class(temp_file_path)
-                    else:
-                        update_progress(current_stage=f"Файл {filename} не найден в MongoDB")
-                        continue
-                else:
-                    # Use file directly from filesystem
-                    loader = loader_class(filename)
-                
-                file_documents = loader.load()
-                documents.extend(file_documents)
-                
-                processed_files += 1
-                update_progress(
-                    processed_files=processed_files,
-                    current_stage=f"Загружен файл: {os.path.basename(filename)}"
-                )
-            except Exception as e:
-                print(f"Error loading {filename}: {e}")
-                update_progress(current_stage=f"Ошибка при загрузке файла {os.path.basename(filename)}: {str(e)}")
-        
-        # Обновляем информацию о документах
-        update_progress(
-            total_documents=len(documents), 
-            current_stage="Разбиение документов на чанки"
-        )
 
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=settings.CHUNK_SIZE,
-            chunk_overlap=settings.CHUNK_OVERLAP,
-        )
-        chunked_documents = text_splitter.split_documents(documents)
-        
-        update_progress(
-            total_documents=len(chunked_documents),
-            current_stage="Загрузка модели эмбеддингов"
-        )
-        
-        # Проверяем, есть ли документы для обработки
-        if not chunked_documents:
-            error_message = "Не удалось извлечь текст из документов. Список документов для векторизации пуст."
-            print(error_message)
-            update_progress(error=error_message)
-            # Сбрасываем флаг is_processing и завершаем функцию
-            await asyncio.sleep(1)
-            update_progress(is_processing=False)
-            return
-        
-        embeddings = OpenAIEmbeddings()
-        
-        update_progress(current_stage="Создание векторной базы данных")
-        
-        update_progress(processed_documents=len(chunked_documents) - 1)
-        
-        # Configure Chroma to use MongoDB or local storage
-        if settings.USE_MONGODB:
-            # Use MongoDB for storing vectors with Chroma's MongoDB integration
-            from chromadb.config import Settings as ChromaSettings
-            from langchain_mongodb import MongoDBAtlasVectorSearch
-            from langchain_mongodb.vectorstores import MongoDBAtlasVectorSearch
+        live_db = await asyncio.to_thread(open_vector_store, None)
+        full_rebuild = full_rebuild or not is_current_index(live_db)
+        if full_rebuild:
+            filenames = None
+        # New chunks must land in the embedding space of the existing ones
+        provider = select_indexing_provider() if full_rebuild else get_collection_provider(live_db)
+
+        try:
+            db, changed_files, removed_files, total_chunks = await sync_collection(provider, full_rebuild, filenames)
+        except Exception as e:
+            if not full_rebuild or provider == PROVIDER_LOCAL:
+                raise
+            print(f"Ошибка при создании эмбеддингов OpenAI, используется локальная модель: {e}")
+            update_progress(current_stage="Создание векторной базы данных (локальная модель эмбеддингов)")
+            db, changed_files, removed_files, total_chunks = await sync_collection(PROVIDER_LOCAL, True)
+
+        if full_rebuild:
+            # Проверяем, есть ли документы для обработки
+            if not await asyncio.to_thread(db._collection.count):
+                await asyncio.to_thread(drop_collection, db, STAGING_COLLECTION_NAME)
+                raise RuntimeError("Не удалось извлечь текст из документов. Список документов для векторизации пуст.")
+            # Chat requests keep querying the previous base until the new one is complete
+            with progress_stage("promote"):
+                await asyncio.to_thread(promote_staging_collection, db)
 
-            # Initialize MongoDB for vector storage
-            update_progress(current_stage="Инициализация MongoDB для хранения векторов")
-            
-            # Use Chroma with MongoDB
-            db = Chroma.from_documents(
-                documents=chunked_documents,
-                embedding=embeddings,
-                collection_name="RAG",
-                client_settings=Settings(anonymized_telemetry=False),
-                persist_directory=None  # No local persist directory when using MongoDB
-            )
-        else:
-            # Use local filesystem
-            db = Chroma.from_documents(
-                documents=chunked_documents,
-                embedding=embeddings,
-                collection_name="RAG",
-                client_settings=Settings(anonymized_telemetry=False),
-                persist_directory=db_path
-            )
-        
         # Обновляем финальный статус
         update_progress(
-            processed_documents=len(chunked_documents),
-            current_stage="Обработка завершена",
+            total_documents=total_chunks,
+            processed_documents=total_chunks,
+            current_stage="Обработка завершена" if changed_files or removed_files or full_rebuild else "Изменений нет",
             percent_complete=100
         )
-        
-        print("Documents db upload done")
-        
-        # Через 5 секунд сбросим флаг is_processing
-        await asyncio.sleep(5)
+
+        print(f"Documents db upload done: {changed_files} changed, {len(removed_files)} removed, {total_chunks} chunks")
+
         update_progress(is_processing=False)
-        
+
+        return {
+            "full_rebuild": full_rebuild,
+            "promoted": full_rebuild,
+            "changed_files": changed_files,
+            "removed_files": len(removed_files),
+            "total_chunks": total_chunks
+        }
+
+    except asyncio.CancelledError:
+        update_progress(error="Обработка отменена")
+        raise
     except Exception as e:
         error_message = f"Ошибка при обработке: {str(e)}"
         print(error_message)
         update_progress(error=error_message)
-
-
+        raise
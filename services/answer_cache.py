@@ -0,0 +1,123 @@
+import time
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from config import settings
+from core.metrics import ANSWER_CACHE_HITS, ANSWER_CACHE_MISSES
+
+
+def normalize_question(question):
+    """Case- and whitespace-insensitive form of a question used as the exact-match key"""
+    return " ".join(question.casefold().split()).rstrip("?!. ")
+
+
+class _Entry:
+    __slots__ = ("answer", "vector", "expires_at")
+
+    def __init__(self, answer, vector, expires_at):
+        self.answer = answer
+        self.vector = vector
+        self.expires_at = expires_at
+
+
+class AnswerCache:
+    """
+    LRU cache of chat answers with a TTL.
+    Lookups go by normalized question first and, when a similarity threshold
+    is set, by cosine similarity of the question embedding.
+    Every corpus change must call invalidate(): answers computed against the
+    old corpus are dropped and in-flight ones are not stored.
+    """
+
+    def __init__(self, max_size, ttl, similarity_threshold=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self._entries = OrderedDict()
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    @property
+    def generation(self):
+        """Corpus generation; pass it back to put() to avoid storing stale answers"""
+        return self._generation
+
+    @property
+    def semantic(self):
+        return self.similarity_threshold is not None
+
+    def _evict_expired(self, now):
+        expired = [key for key, entry in self._entries.items() if entry.expires_at <= now]
+        for key in expired:
+            del self._entries[key]
+
+    def get(self, question):
+        """Exact-match lookup"""
+        key = normalize_question(question)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at > now:
+                self._entries.move_to_end(key)
+                ANSWER_CACHE_HITS.labels("exact").inc()
+                return entry.answer
+            if entry is not None:
+                del self._entries[key]
+        return None
+
+    def get_similar(self, vector):
+        """Near-duplicate lookup by question embedding"""
+        if not self.semantic:
+            return None
+        query = _unit(vector)
+        now = time.monotonic()
+        with self._lock:
+            self._evict_expired(now)
+            candidates = [(key, entry) for key, entry in self._entries.items() if entry.vector is not None]
+            if not candidates:
+                return None
+            scores = np.stack([entry.vector for _, entry in candidates]) @ query
+            best = int(np.argmax(scores))
+            if scores[best] < self.similarity_threshold:
+                return None
+            key, entry = candidates[best]
+            self._entries.move_to_end(key)
+        ANSWER_CACHE_HITS.labels("semantic").inc()
+        return entry.answer
+
+    def record_miss(self):
+        ANSWER_CACHE_MISSES.inc()
+
+    def put(self, question, answer, vector=None, generation=None):
+        key = normalize_question(question)
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            self._entries[key] = _Entry(
+                answer,
+                _unit(vector) if vector is not None and self.semantic else None,
+                time.monotonic() + self.ttl
+            )
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+
+
+def _unit(vector):
+    array = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(array)
+    return array / norm if norm else array
+
+
+answer_cache = AnswerCache(
+    max_size=settings.ANSWER_CACHE_MAX_SIZE,
+    ttl=settings.ANSWER_CACHE_TTL_SECONDS,
+    similarity_threshold=settings.ANSWER_CACHE_SIMILARITY_THRESHOLD
+)
@@ -0,0 +1,185 @@
+import io
+import os
+import asyncio
+import pathlib
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from langchain_core.documents import Document
+from langchain_community.document_loaders import (
+    PyPDFLoader,
+    TextLoader,
+    Docx2txtLoader,
+    UnstructuredHTMLLoader,
+    UnstructuredMarkdownLoader,
+    UnstructuredRTFLoader,
+    UnstructuredODTLoader
+)
+
+from config import settings
+
+# Список разрешенных форматов документов (должен совпадать с api/documents.py)
+ALLOWED_DOCUMENT_EXTENSIONS = {
+    '.pdf', '.txt', '.docx', '.doc', '.rtf', '.md', '.markdown', 
+    '.odt', '.tex', '.html', '.htm'
+}
+
+# Map file extensions to appropriate document loaders
+DOCUMENT_LOADERS = {
+    '.pdf': PyPDFLoader,
+    '.txt': TextLoader,
+    '.docx': Docx2txtLoader,
+    '.doc': Docx2txtLoader,  # Note: Requires antiword for .doc files
+    '.rtf': UnstructuredRTFLoader,
+    '.md': UnstructuredMarkdownLoader,
+    '.markdown': UnstructuredMarkdownLoader,
+    '.odt': UnstructuredODTLoader,
+    '.html': UnstructuredHTMLLoader,
+    '.htm': UnstructuredHTMLLoader,
+    '.tex': TextLoader,
+}
+
+
+def _decode_text(content):
+    try:
+        return content.decode("utf-8")
+    except UnicodeDecodeError:
+        # Russian documents saved outside of UTF-8
+        return content.decode("cp1251")
+
+
+def _load_text_bytes(content, source):
+    return [Document(page_content=_decode_text(content), metadata={"source": source})]
+
+
+def _load_pdf_bytes(content, source):
+    from pypdf import PdfReader
+
+    reader = PdfReader(io.BytesIO(content))
+    return [
+        Document(page_content=page.extract_text(), metadata={"source": source, "page": page_number})
+        for page_number, page in enumerate(reader.pages)
+    ]
+
+
+def _load_docx_bytes(content, source):
+    import docx2txt
+
+    return [Document(page_content=docx2txt.process(io.BytesIO(content)), metadata={"source": source})]
+
+
+def _load_markdown_bytes(content, source):
+    from unstructured.partition.md import partition_md
+
+    elements = partition_md(text=_decode_text(content))
+    return [Document(page_content="\n\n".join(str(el) for el in elements), metadata={"source": source})]
+
+
+def _load_html_bytes(content, source):
+    from unstructured.partition.html import partition_html
+
+    elements = partition_html(text=_decode_text(content))
+    return [Document(page_content="\n\n".join(str(el) for el in elements), metadata={"source": source})]
+
+
+# Formats that can be parsed straight from memory; the rest go through DOCUMENT_LOADERS and a temp file
+BYTES_LOADERS = {
+    '.pdf': _load_pdf_bytes,
+    '.txt': _load_text_bytes,
+    '.tex': _load_text_bytes,
+    '.docx': _load_docx_bytes,
+    '.md': _load_markdown_bytes,
+    '.markdown': _load_markdown_bytes,
+    '.html': _load_html_bytes,
+    '.htm': _load_html_bytes,
+}
+
+
+def load_document(path):
+    """Parse a file into LangChain documents. Runs inside the parse pool workers."""
+    loader_class = DOCUMENT_LOADERS[pathlib.Path(path).suffix.lower()]
+    return loader_class(path).load()
+
+
+def load_document_bytes(filename, content):
+    """Parse file content held in memory. Runs inside the parse pool workers."""
+    file_ext = pathlib.Path(filename).suffix.lower()
+    if file_ext in BYTES_LOADERS:
+        return BYTES_LOADERS[file_ext](content, filename)
+
+    # The loader only accepts a path
+    with tempfile.NamedTemporaryFile(suffix=file_ext, delete=False) as temp_file:
+        temp_file.write(content)
+    try:
+        documents = load_document(temp_file.name)
+    finally:
+        os.remove(temp_file.name)
+    for document in documents:
+        document.metadata["source"] = filename
+    return documents
+
+
+# Singleton parse pool
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+
+
+def get_parse_pool():
+    """Get or create the process pool used for document parsing"""
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            # spawn: forking a process that runs an event loop and thread pools is unsafe
+            _parse_pool = ProcessPoolExecutor(
+                max_workers=settings.PARSE_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _parse_pool
+
+
+def _discard_parse_pool(pool):
+    """Kill a pool whose worker is stuck; the next get_parse_pool() call starts a fresh one"""
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is pool:
+            _parse_pool = None
+    for process in list(pool._processes.values()):
+        process.terminate()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_parse_pool():
+    global _parse_pool
+    with _parse_pool_lock:
+        pool, _parse_pool = _parse_pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def parse_document(filename, content=None, path=None, timeout=None):
+    """
+    Parse a file in the process pool without blocking the event loop,
+    either from its content in memory or from a local path.
+    A parse exceeding the timeout has its pool killed, since a single worker
+    cannot be stopped on its own; other files caught in that pool are retried once.
+    """
+    timeout = timeout or settings.PARSE_TIMEOUT_SECONDS
+    loop = asyncio.get_running_loop()
+    for attempt in range(2):
+        pool = get_parse_pool()
+        try:
+            if content is not None:
+                future = loop.run_in_executor(pool, load_document_bytes, filename, content)
+            else:
+                future = loop.run_in_executor(pool, load_document, path)
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            _discard_parse_pool(pool)
+            raise TimeoutError(f"Parsing {filename} took longer than {timeout} s")
+        except BrokenProcessPool:
+            _discard_parse_pool(pool)
+            if attempt:
+                raise
@@ -0,0 +1,192 @@
+import time
+import random
+import asyncio
+
+from config import settings
+from services.embeddings import EmbeddingProviderUnavailable
+
+
+class TokenBucket:
+    """Token-bucket rate limiter: `rate` acquisitions per second, bursts of up to `capacity`"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+async def retry_with_backoff(func, *args, attempts, base_delay):
+    """Await func(*args), retrying failures with exponential backoff and jitter"""
+    for attempt in range(attempts):
+        try:
+            return await func(*args)
+        except EmbeddingProviderUnavailable:
+            # The circuit breaker already decided; retrying now would only fail fast again
+            raise
+        except Exception as e:
+            if attempt == attempts - 1:
+                raise
+            delay = base_delay * 2 ** attempt * random.uniform(0.5, 1.0)
+            print(f"Embedding batch failed ({e}), retry in {delay:.1f} s")
+            await asyncio.sleep(delay)
+
+
+class _FileState:
+    __slots__ = ("pending", "head", "on_complete", "open")
+
+    def __init__(self):
+        # Chunks queued or in flight that must be stored before the head
+        self.pending = 0
+        self.head = None
+        self.on_complete = None
+        self.open = True
+
+
+class BatchEmbedder:
+    """
+    Embedding stage of the ingestion pipeline.
+    Chunks are embedded in batches of EMBEDDING_BATCH_SIZE, with up to
+    EMBEDDING_CONCURRENCY batches in flight, EMBEDDING_REQUESTS_PER_MINUTE
+    requests and retries with backoff, and are upserted into the collection
+    batch by batch.
+
+    Each committed batch is a checkpoint. Chunk 0 of a file is held back until
+    the rest of the file is stored, so its presence marks the file as fully
+    indexed. After an interruption the file is indexed again and the batches
+    already in the collection are skipped instead of being re-embedded.
+    """
+
+    def __init__(self, db, embeddings, on_progress=None):
+        self.db = db
+        self.embeddings = embeddings
+        self.on_progress = on_progress
+        self.batch_size = max(1, settings.EMBEDDING_BATCH_SIZE)
+        self.stored_chunks = 0
+        self.embedded_chunks = 0
+        self._buffer = []
+        self._files = {}
+        self._tasks = set()
+        self._slots = asyncio.Semaphore(max(1, settings.EMBEDDING_CONCURRENCY))
+        self._bucket = TokenBucket(
+            rate=settings.EMBEDDING_REQUESTS_PER_MINUTE / 60,
+            capacity=max(1, settings.EMBEDDING_CONCURRENCY)
+        )
+        self._error = None
+
+    def begin_file(self, filename):
+        self._raise_error()
+        self._files[filename] = _FileState()
+
+    async def add_chunk(self, filename, chunk_id, chunk):
+        """
+        Queue a chunk of an open file.
+        Waits while all batch slots are busy, which bounds the memory held by the stage.
+        """
+        self._raise_error()
+        state = self._files[filename]
+        if chunk.metadata["chunk_index"] == 0:
+            state.head = (chunk_id, chunk)
+            return
+        state.pending += 1
+        self._buffer.append((chunk_id, chunk))
+        while len(self._buffer) >= self.batch_size:
+            await self._submit()
+
+    async def end_file(self, filename, on_complete=None):
+        """Close a file; on_complete is awaited once all of its chunks are stored"""
+        state = self._files[filename]
+        state.on_complete = on_complete
+        state.open = False
+        if state.head is None:
+            del self._files[filename]
+            if on_complete is not None:
+                await on_complete()
+        elif state.pending == 0:
+            self._buffer.append(state.head)
+
+    async def flush(self):
+        """Store everything queued so far; raises the first batch error"""
+        while self._buffer or self._tasks:
+            if self._buffer:
+                await self._submit()
+            elif self._tasks:
+                await asyncio.wait(set(self._tasks))
+            self._raise_error()
+        self._raise_error()
+
+    async def close(self):
+        """Cancel batches in flight, e.g. when the run is aborted"""
+        for task in self._tasks:
+            task.cancel()
+        if self._tasks:
+            await asyncio.wait(set(self._tasks))
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+    async def _submit(self):
+        batch, self._buffer = self._buffer[:self.batch_size], self._buffer[self.batch_size:]
+        await self._slots.acquire()
+        task = asyncio.create_task(self._store_batch(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _store_batch(self, batch):
+        try:
+            ids = [chunk_id for chunk_id, _ in batch]
+            collection = self.db._collection
+            stored = await asyncio.to_thread(collection.get, ids=ids, include=[])
+            stored_ids = set(stored["ids"])
+            missing = [(chunk_id, chunk) for chunk_id, chunk in batch if chunk_id not in stored_ids]
+            if missing:
+                texts = [chunk.page_content for _, chunk in missing]
+                await self._bucket.acquire()
+                vectors = await retry_with_backoff(
+                    self.embeddings.aembed_documents, texts,
+                    attempts=settings.EMBEDDING_MAX_RETRIES,
+                    base_delay=settings.EMBEDDING_RETRY_BASE_DELAY
+                )
+                await asyncio.to_thread(
+                    collection.upsert,
+                    ids=[chunk_id for chunk_id, _ in missing],
+                    embeddings=vectors,
+                    metadatas=[chunk.metadata for _, chunk in missing],
+                    documents=texts
+                )
+                self.embedded_chunks += len(missing)
+            self.stored_chunks += len(batch)
+            await self._commit(batch)
+            if self.on_progress is not None:
+                self.on_progress(self.stored_chunks)
+        except Exception as e:
+            if self._error is None:
+                self._error = e
+        finally:
+            self._slots.release()
+
+    async def _commit(self, batch):
+        for _, chunk in batch:
+            filename = chunk.metadata["filename"]
+            state = self._files[filename]
+            if chunk.metadata["chunk_index"] == 0:
+                del self._files[filename]
+                if state.on_complete is not None:
+                    await state.on_complete()
+                continue
+            state.pending -= 1
+            if state.pending == 0 and not state.open:
+                self._buffer.append(state.head)
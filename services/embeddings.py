@@ -0,0 +1,187 @@
+import time
+import threading
+
+from langchain_core.embeddings import Embeddings
+
+from config import settings
+from core.metrics import EMBEDDING_CIRCUIT_OPEN, EMBEDDING_PROVIDER_FAILURES
+
+PROVIDER_OPENAI = "openai"
+PROVIDER_LOCAL = "local"
+
+# Collection metadata key recording which provider built the index
+PROVIDER_METADATA_KEY = "embedding_provider"
+
+
+class EmbeddingProviderUnavailable(Exception):
+    """Raised when the provider a collection was indexed with cannot be used right now"""
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and rejects calls
+    for `reset_timeout` seconds, then lets a single trial call through.
+    """
+
+    def __init__(self, name, failure_threshold, reset_timeout):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Whether a call may be attempted now"""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._trial_in_flight or time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+        EMBEDDING_CIRCUIT_OPEN.labels(self.name).set(0)
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                opened = True
+            else:
+                opened = False
+        EMBEDDING_PROVIDER_FAILURES.labels(self.name).inc()
+        if opened:
+            EMBEDDING_CIRCUIT_OPEN.labels(self.name).set(1)
+
+    def record_abandoned(self):
+        """A call was cancelled: it says nothing about the provider, but frees the trial slot"""
+        with self._lock:
+            self._trial_in_flight = False
+
+    @property
+    def is_open(self):
+        with self._lock:
+            return self._opened_at is not None
+
+
+class CircuitBreakingEmbeddings(Embeddings):
+    """Embeddings wrapper that fails fast while the breaker of the provider is open"""
+
+    def __init__(self, embeddings, breaker):
+        self.embeddings = embeddings
+        self.breaker = breaker
+
+    def _check(self):
+        if not self.breaker.allow():
+            raise EmbeddingProviderUnavailable(f"Embedding provider '{self.breaker.name}' is unavailable")
+
+    def _call(self, func, *args):
+        self._check()
+        try:
+            result = func(*args)
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        except BaseException:
+            # Cancellation (client disconnect, job cancel, timeout) must not leave the breaker stuck open
+            self.breaker.record_abandoned()
+            raise
+        self.breaker.record_success()
+        return result
+
+    async def _acall(self, func, *args):
+        self._check()
+        try:
+            result = await func(*args)
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        except BaseException:
+            # Cancellation (client disconnect, job cancel, timeout) must not leave the breaker stuck open
+            self.breaker.record_abandoned()
+            raise
+        self.breaker.record_success()
+        return result
+
+    def embed_documents(self, texts):
+        return self._call(self.embeddings.embed_documents, texts)
+
+    def embed_query(self, text):
+        return self._call(self.embeddings.embed_query, text)
+
+    async def aembed_documents(self, texts):
+        return await self._acall(self.embeddings.aembed_documents, texts)
+
+    async def aembed_query(self, text):
+        return await self._acall(self.embeddings.aembed_query, text)
+
+
+openai_breaker = CircuitBreaker(
+    PROVIDER_OPENAI,
+    failure_threshold=settings.OPENAI_CIRCUIT_FAILURE_THRESHOLD,
+    reset_timeout=settings.OPENAI_CIRCUIT_RESET_SECONDS
+)
+
+# Singleton providers
+_providers = {}
+_providers_lock = threading.Lock()
+
+
+def _create_provider(name):
+    if name == PROVIDER_OPENAI:
+        from langchain_openai import OpenAIEmbeddings
+
+        return CircuitBreakingEmbeddings(
+            OpenAIEmbeddings(
+                request_timeout=settings.OPENAI_EMBEDDINGS_TIMEOUT,
+                max_retries=settings.OPENAI_EMBEDDINGS_MAX_RETRIES
+            ),
+            openai_breaker
+        )
+    if name == PROVIDER_LOCAL:
+        from langchain_huggingface import HuggingFaceEmbeddings
+
+        return HuggingFaceEmbeddings(
+            model_name=settings.LOCAL_EMBEDDINGS_MODEL,
+            model_kwargs={'trust_remote_code': True}
+        )
+    raise ValueError(f"Unknown embedding provider: {name}")
+
+
+def get_embeddings(name):
+    """Get or create the embeddings of a provider; the local model is loaded only once"""
+    provider = _providers.get(name)
+    if provider is None:
+        with _providers_lock:
+            if name not in _providers:
+                _providers[name] = _create_provider(name)
+            provider = _providers[name]
+    return provider
+
+
+def select_indexing_provider():
+    """Provider to build a new index with: OpenAI unless its breaker is open"""
+    return PROVIDER_LOCAL if openai_breaker.is_open else PROVIDER_OPENAI
+
+
+def get_collection_provider(db):
+    """
+    Provider a collection was indexed with. Collections built before the
+    provider was recorded were embedded with OpenAI.
+    """
+    metadata = db._collection.metadata or {}
+    return metadata.get(PROVIDER_METADATA_KEY, PROVIDER_OPENAI)
+
+
+def warm_up_local_embeddings():
+    """Load the local model ahead of the first request that needs it"""
+    get_embeddings(PROVIDER_LOCAL).embed_query("warm up")
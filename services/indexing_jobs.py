@@ -0,0 +1,343 @@
+import sys
+import uuid
+import asyncio
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, update, func
+from sqlalchemy.exc import IntegrityError
+
+from config import settings
+from core.progress import INITIAL_PROGRESS
+from db.session import AsyncSessionLocal
+from models.job import IndexingJob, JOB_QUEUED, JOB_RUNNING, JOB_SUCCEEDED, JOB_FAILED, JOB_CANCELLED
+
+
+class JobClaimLost(Exception):
+    """The job was requeued or taken over by another worker: this worker must stop it"""
+
+
+def _merge_filenames(job, full_rebuild, filenames):
+    """File scope of a queued job after another request is folded into it"""
+    if full_rebuild or job.full_rebuild or filenames is None or job.filenames is None:
+        return None
+    return sorted(set(job.filenames) | set(filenames))
+
+
+async def enqueue_job(full_rebuild=False, filenames=None, requested_by=None):
+    """
+    Queue a vector base update, or fold it into the job already waiting in the queue.
+    A running job is left alone: the queued one starts after it and sees every change
+    made in the meantime. Returns the job and whether the request was coalesced.
+    """
+    filenames = sorted(set(filenames)) if filenames is not None else None
+    for attempt in range(3):
+        async with AsyncSessionLocal() as db:
+            try:
+                async with db.begin():
+                    job = await db.scalar(
+                        select(IndexingJob).where(IndexingJob.status == JOB_QUEUED).with_for_update()
+                    )
+                    if job is not None:
+                        job.filenames = _merge_filenames(job, full_rebuild, filenames)
+                        job.full_rebuild = job.full_rebuild or full_rebuild
+                        job.requests += 1
+                        coalesced = True
+                    else:
+                        job = IndexingJob(
+                            id=uuid.uuid4().hex,
+                            status=JOB_QUEUED,
+                            full_rebuild=full_rebuild,
+                            filenames=None if full_rebuild else filenames,
+                            requested_by=requested_by,
+                            requests=1,
+                            cancel_requested=False,
+                            created_at=datetime.utcnow()
+                        )
+                        db.add(job)
+                        coalesced = False
+                return job, coalesced
+            except IntegrityError:
+                # Another request queued a job at the same moment: coalesce with it
+                if attempt == 2:
+                    raise
+
+
+async def get_job(job_id):
+    async with AsyncSessionLocal() as db:
+        return await db.get(IndexingJob, job_id)
+
+
+async def list_jobs(limit=20):
+    """Most recent jobs first"""
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(select(IndexingJob).order_by(IndexingJob.created_at.desc()).limit(limit))
+        return result.scalars().all()
+
+
+async def cancel_job(job_id):
+    """
+    Cancel a job. A queued job is cancelled at once, a running one is flagged
+    and stopped by its worker at the next heartbeat. Returns None for an unknown id.
+    """
+    async with AsyncSessionLocal() as db:
+        async with db.begin():
+            job = await db.get(IndexingJob, job_id, with_for_update=True)
+            if job is None:
+                return None
+            if job.status == JOB_QUEUED:
+                job.status = JOB_CANCELLED
+                job.finished_at = datetime.utcnow()
+            elif job.status == JOB_RUNNING:
+                job.cancel_requested = True
+        return job
+
+
+async def _requeue_stale_jobs(db):
+    """Put jobs of a worker that stopped sending heartbeats back into the queue"""
+    stale_before = datetime.utcnow() - timedelta(seconds=settings.INDEXING_JOB_STALE_SECONDS)
+    result = await db.execute(
+        select(IndexingJob)
+        .where(IndexingJob.status == JOB_RUNNING, IndexingJob.heartbeat_at < stale_before)
+        .with_for_update(skip_locked=True)
+    )
+    for job in result.scalars().all():
+        queued = await db.scalar(
+            select(IndexingJob).where(IndexingJob.status == JOB_QUEUED).with_for_update()
+        )
+        if queued is not None:
+            # The queued job takes over the interrupted one's scope
+            queued.filenames = _merge_filenames(queued, job.full_rebuild, job.filenames)
+            queued.full_rebuild = queued.full_rebuild or job.full_rebuild
+            queued.requests += job.requests
+            job.status = JOB_FAILED
+            job.error = f"Interrupted, continued by job {queued.id}"
+            job.finished_at = datetime.utcnow()
+        elif job.cancel_requested:
+            job.status = JOB_CANCELLED
+            job.finished_at = datetime.utcnow()
+        else:
+            job.status = JOB_QUEUED
+            job.started_at = None
+            job.heartbeat_at = None
+        # The interrupted worker may still be alive: its heartbeats and result are refused from now on
+        job.claim_token = None
+        await db.flush()
+
+
+async def claim_next_job():
+    """
+    Take the queued job for execution. Only one job runs at a time across all
+    workers, so this returns None while another job is running.
+    """
+    async with AsyncSessionLocal() as db:
+        try:
+            async with db.begin():
+                await _requeue_stale_jobs(db)
+                running = await db.scalar(
+                    select(func.count()).select_from(IndexingJob).where(IndexingJob.status == JOB_RUNNING)
+                )
+                if running:
+                    return None
+                job = await db.scalar(
+                    select(IndexingJob)
+                    .where(IndexingJob.status == JOB_QUEUED)
+                    .order_by(IndexingJob.created_at)
+                    .limit(1)
+                    .with_for_update(skip_locked=True)
+                )
+                if job is None:
+                    return None
+                now = datetime.utcnow()
+                job.status = JOB_RUNNING
+                job.started_at = now
+                job.heartbeat_at = now
+                job.claim_token = uuid.uuid4().hex
+        except IntegrityError:
+            # Another worker claimed a job between the check above and this update;
+            # the single-running index turns that race into a rollback
+            return None
+        return job
+
+
+def _claimed(job):
+    """Update of a job that only succeeds while this worker still holds it"""
+    return update(IndexingJob).where(
+        IndexingJob.id == job.id,
+        IndexingJob.status == JOB_RUNNING,
+        IndexingJob.claim_token == job.claim_token
+    )
+
+
+async def heartbeat_job(job, progress=None):
+    """
+    Mark the claimed job as alive and store its latest progress, so every API process sees it.
+    Returns True when cancellation was requested; raises JobClaimLost when the job is no longer ours.
+    """
+    values = {"heartbeat_at": datetime.utcnow()}
+    if progress is not None:
+        values["progress"] = progress
+    async with AsyncSessionLocal() as db:
+        async with db.begin():
+            result = await db.execute(_claimed(job).values(**values).returning(IndexingJob.cancel_requested))
+            cancel_requested = result.scalar_one_or_none()
+    if cancel_requested is None:
+        raise JobClaimLost(f"Indexing job {job.id} is no longer claimed by this worker")
+    return cancel_requested
+
+
+async def finish_job(job, status, error=None, result=None, progress=None):
+    """Record the outcome of a claimed job; returns False when the job is no longer ours"""
+    values = {"status": status, "error": error, "result": result, "finished_at": datetime.utcnow()}
+    if progress is not None:
+        values["progress"] = progress
+    async with AsyncSessionLocal() as db:
+        async with db.begin():
+            updated = await db.execute(_claimed(job).values(**values))
+            return updated.rowcount == 1
+
+
+async def get_current_job():
+    """The running job, else the queued one, else the most recently created one"""
+    async with AsyncSessionLocal() as db:
+        for status in (JOB_RUNNING, JOB_QUEUED):
+            job = await db.scalar(select(IndexingJob).where(IndexingJob.status == status).limit(1))
+            if job is not None:
+                return job
+        return await db.scalar(select(IndexingJob).order_by(IndexingJob.created_at.desc()).limit(1))
+
+
+def job_progress(job):
+    """Progress of a job in the shape /update-progress has always returned"""
+    progress = dict(job.progress or INITIAL_PROGRESS)
+    progress["job_id"] = job.id
+    progress["status"] = job.status
+    progress["is_processing"] = job.status in (JOB_QUEUED, JOB_RUNNING)
+    if job.status == JOB_QUEUED:
+        progress["current_stage"] = "Ожидание запуска"
+    if job.error:
+        progress["error"] = job.error
+    return progress
+
+
+class _ProgressFeed:
+    """
+    Polls one job's state and fans it out to every subscriber in this process,
+    so the number of open progress streams does not multiply database queries.
+    """
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.job = None
+        self.version = 0
+        self.finished = False
+        self.subscribers = 0
+        self.changed = asyncio.Condition()
+        self.task = asyncio.create_task(self._poll())
+
+    async def _poll(self):
+        state = None
+        try:
+            while True:
+                try:
+                    job = await get_job(self.job_id)
+                except Exception as e:
+                    print(f"Failed to poll indexing job {self.job_id}: {e}")
+                    job = self.job
+                new_state = (job.status, job.progress, job.error) if job is not None else None
+                if new_state != state:
+                    state = new_state
+                    async with self.changed:
+                        self.job = job
+                        self.version += 1
+                        self.changed.notify_all()
+                if job is None or job.status not in (JOB_QUEUED, JOB_RUNNING):
+                    return
+                await asyncio.sleep(settings.INDEXING_PROGRESS_INTERVAL_SECONDS)
+        finally:
+            async with self.changed:
+                self.finished = True
+                self.changed.notify_all()
+
+
+_feeds = {}
+
+
+async def subscribe_job_progress(job_id):
+    """
+    Yield the job each time its state changes, at most once per
+    INDEXING_PROGRESS_INTERVAL_SECONDS, until it finishes. Yields None for an unknown job.
+    """
+    feed = _feeds.get(job_id)
+    if feed is None or feed.finished:
+        feed = _feeds[job_id] = _ProgressFeed(job_id)
+    feed.subscribers += 1
+    seen = 0
+    try:
+        while True:
+            async with feed.changed:
+                await feed.changed.wait_for(lambda: feed.version != seen or feed.finished)
+                job, version, finished = feed.job, feed.version, feed.finished
+            if version != seen:
+                seen = version
+                yield job
+            if finished:
+                return
+    finally:
+        feed.subscribers -= 1
+        if not feed.subscribers:
+            feed.task.cancel()
+            if _feeds.get(job_id) is feed:
+                del _feeds[job_id]
+
+
+async def watch_finished_jobs(stop_event):
+    """
+    Apply the outcome of jobs finished by any worker to this API process:
+    drop cached answers and, after a full rebuild, switch chat to the new collection.
+    """
+    finished = (JOB_SUCCEEDED, JOB_FAILED, JOB_CANCELLED)
+    try:
+        async with AsyncSessionLocal() as db:
+            last_seen = await db.scalar(select(func.max(IndexingJob.finished_at)))
+    except Exception as e:
+        print(f"Failed to poll indexing jobs: {e}")
+        last_seen = None
+    last_seen = last_seen or datetime.utcnow()
+
+    while not stop_event.is_set():
+        try:
+            await asyncio.wait_for(stop_event.wait(), timeout=settings.INDEXING_JOB_POLL_SECONDS)
+            break
+        except asyncio.TimeoutError:
+            pass
+        try:
+            async with AsyncSessionLocal() as db:
+                result = await db.execute(
+                    select(IndexingJob)
+                    .where(IndexingJob.status.in_(finished), IndexingJob.finished_at > last_seen)
+                    .order_by(IndexingJob.finished_at)
+                )
+                jobs = result.scalars().all()
+        except Exception as e:
+            print(f"Failed to poll indexing jobs: {e}")
+            continue
+        for job in jobs:
+            last_seen = job.finished_at
+            if job.status == JOB_SUCCEEDED:
+                await asyncio.to_thread(apply_job_result, job.result or {})
+            elif job.started_at is not None and not job.full_rebuild:
+                # An interrupted incremental run may already have replaced some files in the live collection
+                await asyncio.to_thread(apply_job_result, {"changed_files": True})
+
+
+def apply_job_result(result):
+    """Bring this process's answer cache and retrieval engine in line with a finished job"""
+    if not (result.get("promoted") or result.get("changed_files") or result.get("removed_files")):
+        return
+    from services.answer_cache import answer_cache
+
+    answer_cache.invalidate()
+    rag_engine = sys.modules.get("services.rag_engine")
+    # An engine that was never built will open the new collection anyway
+    if result.get("promoted") and rag_engine is not None and rag_engine.has_retrieval_engine():
+        rag_engine.reload_retrieval_engine()
@@ -0,0 +1,146 @@
+"""
+Indexing worker: runs queued vector base updates one at a time.
+
+With INDEXING_WORKER_MODE=external it runs as its own process, so rebuilds
+never compete with API requests for the event loop:
+
+    python -m services.indexing_worker
+
+The API and the worker must then share the vector base through a Chroma
+server (CHROMA_SERVER_HOST). With the default embedded mode the same loop
+runs as a task inside the API process.
+"""
+import time
+import asyncio
+import signal
+
+from config import settings
+from core.progress import get_progress, reset_progress
+from models.job import JOB_SUCCEEDED, JOB_FAILED, JOB_CANCELLED
+from services.indexing_jobs import claim_next_job, heartbeat_job, finish_job, JobClaimLost
+
+# Why _watch_job stopped a job
+_STOP_CANCELLED = "cancelled"
+_STOP_CLAIM_LOST = "claim_lost"
+
+
+async def _watch_job(job, task):
+    """
+    Keep the job's heartbeat fresh, publish its progress (throttled to one write
+    per INDEXING_PROGRESS_INTERVAL_SECONDS) and cancel it when an admin asks to.
+    The job is also stopped once it may have been handed to another worker: its
+    claim was taken away, or heartbeats kept failing for half the stale timeout.
+    Returns the reason the job was stopped, None if it finished by itself.
+    """
+    published = None
+    last_heartbeat = time.monotonic()
+    while not task.done():
+        progress = get_progress()
+        stop = None
+        try:
+            if await heartbeat_job(job, progress if progress != published else None):
+                stop = _STOP_CANCELLED
+            published = progress
+            last_heartbeat = time.monotonic()
+        except JobClaimLost as e:
+            print(e)
+            stop = _STOP_CLAIM_LOST
+        except Exception as e:
+            print(f"Failed to update indexing job {job.id}: {e}")
+            if time.monotonic() - last_heartbeat > settings.INDEXING_JOB_STALE_SECONDS / 2:
+                stop = _STOP_CLAIM_LOST
+        if stop is not None:
+            task.cancel()
+            return stop
+        await asyncio.wait({task}, timeout=settings.INDEXING_PROGRESS_INTERVAL_SECONDS)
+    return None
+
+
+async def _finish(job, status, **values):
+    if not await finish_job(job, status, progress=get_progress(), **values):
+        print(f"Indexing job {job.id} was taken over by another worker, its outcome ({status}) is discarded")
+        return False
+    return True
+
+
+async def run_job(job):
+    # The indexing code pulls in LangChain and Chroma, so it is loaded with the first job
+    from services.FilesHandler import process_files_to_vector_db
+
+    print(f"Indexing job {job.id} started (full_rebuild={job.full_rebuild})")
+    reset_progress()
+    task = asyncio.create_task(process_files_to_vector_db(job.full_rebuild, job.filenames))
+    watcher = asyncio.create_task(_watch_job(job, task))
+    try:
+        result = await task
+    except asyncio.CancelledError:
+        stop = watcher.result() if watcher.done() and not watcher.cancelled() else None
+        if stop is None:
+            # The worker itself is stopping: the job is queued again once its heartbeat goes stale
+            task.cancel()
+            raise
+        if stop == _STOP_CLAIM_LOST:
+            print(f"Indexing job {job.id} stopped: it may be running on another worker")
+        elif await _finish(job, JOB_CANCELLED):
+            print(f"Indexing job {job.id} cancelled")
+    except Exception as e:
+        if await _finish(job, JOB_FAILED, error=str(e)):
+            print(f"Indexing job {job.id} failed: {e}")
+    else:
+        if await _finish(job, JOB_SUCCEEDED, result=result):
+            print(f"Indexing job {job.id} done: {result}")
+    finally:
+        watcher.cancel()
+
+
+async def run_worker(stop_event):
+    """Take queued jobs until stop_event is set"""
+    while not stop_event.is_set():
+        try:
+            job = await claim_next_job()
+        except Exception as e:
+            print(f"Failed to claim an indexing job: {e}")
+            job = None
+        if job is not None:
+            await run_job(job)
+            continue
+        try:
+            await asyncio.wait_for(stop_event.wait(), timeout=settings.INDEXING_JOB_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def main():
+    from db.base import Base
+    from db.init_db import upgrade_schema
+    from db.session import async_engine
+
+    if settings.CHROMA_SERVER_HOST is None:
+        print("CHROMA_SERVER_HOST is not set: the API will not see collections built by this process")
+
+    # The worker may start before the API has created the tables
+    async with async_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(upgrade_schema)
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signum, stop_event.set)
+        except NotImplementedError:
+            # Windows: Ctrl+C raises KeyboardInterrupt instead
+            pass
+
+    worker = asyncio.create_task(run_worker(stop_event))
+    await stop_event.wait()
+    worker.cancel()
+    try:
+        await worker
+    except asyncio.CancelledError:
+        pass
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,8 +1,11 @@
+import asyncio
 import motor.motor_asyncio
-from pymongo import MongoClient
-from bson.binary import Binary
+from pymongo import MongoClient, UpdateOne
+from gridfs.errors import NoFile
 import io
 import os
+import hashlib
+from datetime import datetime
 from config import settings
 from core.progress import update_progress
 
@@ -24,45 +27,214 @@ def get_sync_client():
         _sync_client = MongoClient(settings.MONGODB_URL)
     return _sync_client
 
-async def save_file_to_mongodb(filename, file_content):
-    """Save a file to MongoDB"""
+def get_gridfs_bucket():
+    """GridFS bucket holding file contents in fixed-size chunks"""
+    client = get_async_client()
+    db = client[settings.MONGODB_DB_NAME]
+    return motor.motor_asyncio.AsyncIOMotorGridFSBucket(db, bucket_name=settings.MONGODB_GRIDFS_BUCKET_NAME)
+
+async def ensure_mongodb_indexes():
+    """Create the indexes the handler relies on"""
     client = get_async_client()
     db = client[settings.MONGODB_DB_NAME]
     collection = db[settings.MONGODB_COLLECTION_NAME]
     
-    # Check if file already exists
-    existing = await collection.find_one({"filename": filename})
-    if existing:
-        # Update existing document
-        await collection.update_one(
-            {"filename": filename},
-            {"$set": {"content": Binary(file_content)}}
+    await collection.create_index("filename", unique=True)
+    # filename is the tie-breaker of every listing sort, see list_file_metadata_from_mongodb
+    await collection.create_index([("metadata.type", 1), ("filename", 1)])
+    await collection.create_index([("metadata.size", 1), ("filename", 1)])
+    await collection.create_index([("metadata.uploaded_at", 1), ("filename", 1)])
+    await collection.create_index("metadata.content_hash")
+
+async def _write_gridfs_file(bucket, filename, read_chunk):
+    """Stream content into a new GridFS file; returns (file id, size, sha256 hex digest)"""
+    content_hash = hashlib.sha256()
+    size = 0
+    grid_in = bucket.open_upload_stream(filename, chunk_size_bytes=settings.UPLOAD_CHUNK_SIZE)
+    try:
+        while chunk := await read_chunk(settings.UPLOAD_CHUNK_SIZE):
+            content_hash.update(chunk)
+            size += len(chunk)
+            await grid_in.write(chunk)
+        await grid_in.close()
+    except BaseException:
+        await grid_in.abort()
+        raise
+    return grid_in._id, size, content_hash.hexdigest()
+
+def _file_document_update(filename, file_id, size, content_hash):
+    return {
+        "$set": {
+            "file_id": file_id,
+            "metadata.type": os.path.splitext(filename)[1].lower(),
+            "metadata.size": size,
+            "metadata.content_hash": content_hash,
+            "metadata.uploaded_at": datetime.utcnow()
+        },
+        "$unset": {"content": ""}
+    }
+
+async def save_file_stream_to_mongodb(filename, read_chunk):
+    """
+    Save a file to MongoDB from an async `read_chunk(size)` callable (e.g. UploadFile.read).
+    The content is written to GridFS chunk by chunk, so memory per upload stays bounded.
+    Returns the file size and whether the file is new.
+    """
+    client = get_async_client()
+    db = client[settings.MONGODB_DB_NAME]
+    collection = db[settings.MONGODB_COLLECTION_NAME]
+    bucket = get_gridfs_bucket()
+    
+    file_id, size, content_hash = await _write_gridfs_file(bucket, filename, read_chunk)
+    
+    # Point the document at the new content, then drop the previous version
+    previous = await collection.find_one_and_update(
+        {"filename": filename},
+        _file_document_update(filename, file_id, size, content_hash),
+        projection={"file_id": 1},
+        upsert=True
+    )
+    if previous and previous.get("file_id"):
+        await _delete_gridfs_file(bucket, previous["file_id"])
+    
+    return size, previous is None
+
+async def save_file_streams_to_mongodb(files):
+    """
+    Save several files given as (filename, read_chunk) pairs.
+    Contents are streamed to GridFS concurrently (UPLOAD_CONCURRENCY at a time),
+    then all documents are upserted with a single bulk_write.
+    Returns a result per filename: status created/updated/unchanged/error, size or error detail.
+    """
+    client = get_async_client()
+    db = client[settings.MONGODB_DB_NAME]
+    collection = db[settings.MONGODB_COLLECTION_NAME]
+    bucket = get_gridfs_bucket()
+    semaphore = asyncio.Semaphore(max(1, settings.UPLOAD_CONCURRENCY))
+    
+    async def write(filename, read_chunk):
+        async with semaphore:
+            return await _write_gridfs_file(bucket, filename, read_chunk)
+    
+    written = await asyncio.gather(
+        *(write(filename, read_chunk) for filename, read_chunk in files),
+        return_exceptions=True
+    )
+    
+    results = {}
+    stored = {}
+    for (filename, _), outcome in zip(files, written):
+        if isinstance(outcome, Exception):
+            results[filename] = {"status": "error", "detail": str(outcome)}
+        else:
+            stored[filename] = outcome
+    if not stored:
+        return results
+    
+    previous = {
+        doc["filename"]: doc
+        async for doc in collection.find(
+            {"filename": {"$in": list(stored)}},
+            {"filename": 1, "file_id": 1, "metadata.content_hash": 1}
         )
-    else:
-        # Create new document
-        doc = {
-            "filename": filename,
-            "content": Binary(file_content),
-            "metadata": {
-                "type": os.path.splitext(filename)[1].lower(),
-                "size": len(file_content)
-            }
-        }
-        await collection.insert_one(doc)
-        
+    }
+    
+    operations = []
+    written_filenames = []
+    new_file_ids = []
+    obsolete_file_ids = []
+    for filename, (file_id, size, content_hash) in stored.items():
+        old = previous.get(filename)
+        if old and old.get("file_id") and old.get("metadata", {}).get("content_hash") == content_hash:
+            # Same content is already stored, keep it and drop the fresh copy
+            obsolete_file_ids.append(file_id)
+            results[filename] = {"status": "unchanged", "size": size}
+            continue
+        operations.append(UpdateOne(
+            {"filename": filename},
+            _file_document_update(filename, file_id, size, content_hash),
+            upsert=True
+        ))
+        written_filenames.append(filename)
+        new_file_ids.append(file_id)
+        if old and old.get("file_id"):
+            obsolete_file_ids.append(old["file_id"])
+        results[filename] = {"status": "updated" if old else "created", "size": size}
+    
+    if operations:
+        try:
+            await collection.bulk_write(operations, ordered=False)
+        except Exception as e:
+            # Nothing points at the new contents, remove them and keep the old ones
+            for file_id in new_file_ids:
+                await _delete_gridfs_file(bucket, file_id)
+            for filename in written_filenames:
+                results[filename] = {"status": "error", "detail": str(e)}
+            return results
+    
+    for file_id in obsolete_file_ids:
+        await _delete_gridfs_file(bucket, file_id)
+    
+    return results
+
+async def save_file_to_mongodb(filename, file_content):
+    """Save a file to MongoDB"""
+    stream = io.BytesIO(file_content)
+    
+    async def read_chunk(size):
+        return stream.read(size)
+    
+    await save_file_stream_to_mongodb(filename, read_chunk)
     return filename
 
-async def get_file_from_mongodb(filename):
-    """Retrieve a file from MongoDB"""
+async def _find_file_document(filename):
+    client = get_async_client()
+    db = client[settings.MONGODB_DB_NAME]
+    collection = db[settings.MONGODB_COLLECTION_NAME]
+    
+    return await collection.find_one({"filename": filename}, {"file_id": 1, "content": 1})
+
+async def _iter_document_chunks(doc):
+    if "file_id" not in doc:
+        # Stored inline before GridFS was used
+        yield doc["content"]
+        return
+    
+    grid_out = await get_gridfs_bucket().open_download_stream(doc["file_id"])
+    while chunk := await grid_out.readchunk():
+        yield chunk
+
+async def iter_file_chunks_from_mongodb(filename):
+    """Stream a file from MongoDB chunk by chunk; yields nothing if it does not exist"""
+    doc = await _find_file_document(filename)
+    if doc:
+        async for chunk in _iter_document_chunks(doc):
+            yield chunk
+
+async def file_exists_in_mongodb(filename):
+    """Check whether a file is stored in MongoDB"""
     client = get_async_client()
     db = client[settings.MONGODB_DB_NAME]
     collection = db[settings.MONGODB_COLLECTION_NAME]
     
-    doc = await collection.find_one({"filename": filename})
+    return await collection.count_documents({"filename": filename}, limit=1) > 0
+
+async def get_file_from_mongodb(filename):
+    """Retrieve a file from MongoDB"""
+    doc = await _find_file_document(filename)
     if not doc:
         return None
     
-    return doc["content"]
+    content = bytearray()
+    async for chunk in _iter_document_chunks(doc):
+        content.extend(chunk)
+    return bytes(content)
+
+async def _delete_gridfs_file(bucket, file_id):
+    try:
+        await bucket.delete(file_id)
+    except NoFile:
+        pass
 
 async def delete_file_from_mongodb(filename):
     """Delete a file from MongoDB"""
@@ -70,30 +242,134 @@ async def delete_file_from_mongodb(filename):
     db = client[settings.MONGODB_DB_NAME]
     collection = db[settings.MONGODB_COLLECTION_NAME]
     
-    result = await collection.delete_one({"filename": filename})
-    return result.deleted_count > 0
+    doc = await collection.find_one_and_delete({"filename": filename}, projection={"file_id": 1})
+    if not doc:
+        return False
+    if doc.get("file_id"):
+        await _delete_gridfs_file(get_gridfs_bucket(), doc["file_id"])
+    return True
+
+# Everything a listing needs; the content (inline or GridFS pointer) is never read
+FILE_METADATA_PROJECTION = {"_id": 0, "filename": 1, "metadata": 1}
+
+# Sortable listing fields
+FILE_SORT_FIELDS = {
+    "filename": "filename",
+    "size": "metadata.size",
+    "uploaded_at": "metadata.uploaded_at",
+}
+
+# Indexing status filters: the indexed version is compared with the stored one
+FILE_STATUS_QUERIES = {
+    # Legacy documents have neither field, and a missing field equals a missing field in $expr
+    "indexed": {
+        "metadata.indexed_hash": {"$exists": True},
+        "$expr": {"$eq": ["$metadata.indexed_hash", "$metadata.content_hash"]}
+    },
+    "stale": {
+        "metadata.indexed_hash": {"$exists": True},
+        "$expr": {"$ne": ["$metadata.indexed_hash", "$metadata.content_hash"]}
+    },
+    "not_indexed": {"metadata.indexed_hash": {"$exists": False}},
+}
+
+def _after_query(field, descending, value, filename):
+    """Keyset condition for rows strictly after (value, filename) in the listing order"""
+    op = "$lt" if descending else "$gt"
+    if field == "filename":
+        return {"filename": {op: filename}}
+    tie = {field: value, "filename": {op: filename}}
+    if value is None:
+        # Missing values sort first ascending and last descending
+        return tie if descending else {"$or": [{field: {"$ne": None}}, tie]}
+    after = [{field: {op: value}}, tie]
+    if descending:
+        after.append({field: None})
+    return {"$or": after}
+
+async def list_file_metadata_from_mongodb(
+    limit,
+    after=None,
+    sort_by="filename",
+    descending=False,
+    extensions=None,
+    min_size=None,
+    max_size=None,
+    status=None
+):
+    """
+    One page of file metadata, filtered and sorted by sort_by with filename as tie-breaker.
+    after is the (sort value, filename) of the last row of the previous page.
+    Returns (items, has_more).
+    """
+    client = get_async_client()
+    db = client[settings.MONGODB_DB_NAME]
+    collection = db[settings.MONGODB_COLLECTION_NAME]
+    
+    field = FILE_SORT_FIELDS[sort_by]
+    conditions = []
+    if extensions:
+        conditions.append({"metadata.type": {"$in": list(extensions)}})
+    if min_size is not None or max_size is not None:
+        size_range = {}
+        if min_size is not None:
+            size_range["$gte"] = min_size
+        if max_size is not None:
+            size_range["$lte"] = max_size
+        conditions.append({"metadata.size": size_range})
+    if status is not None:
+        conditions.append(FILE_STATUS_QUERIES[status])
+    if after is not None:
+        conditions.append(_after_query(field, descending, *after))
+    query = {"$and": conditions} if conditions else {}
+    
+    direction = -1 if descending else 1
+    sort = [(field, direction)] if field == "filename" else [(field, direction), ("filename", direction)]
+    cursor = collection.find(query, FILE_METADATA_PROJECTION).sort(sort).limit(limit + 1)
+    docs = await cursor.to_list(length=limit + 1)
+    items = [{"filename": doc["filename"], **doc.get("metadata", {})} for doc in docs[:limit]]
+    return items, len(docs) > limit
 
-async def list_files_from_mongodb():
-    """List all files stored in MongoDB"""
+async def count_files_in_mongodb():
+    """Number of stored files, taken from collection metadata rather than a scan"""
     client = get_async_client()
     db = client[settings.MONGODB_DB_NAME]
     collection = db[settings.MONGODB_COLLECTION_NAME]
     
-    cursor = collection.find({}, {"filename": 1, "_id": 0})
-    files = await cursor.to_list(length=None)
-    return [file["filename"] for file in files]
+    return await collection.estimated_document_count()
 
-async def get_temp_file_path(filename, content=None):
+async def iter_file_hashes_from_mongodb(filenames=None):
     """
-    Get or create a temporary file path for a file 
-    that may be stored in MongoDB but needs local access
+    Stream (filename, content hash) pairs, optionally only for the given filenames;
+    the hash is None for files stored before hashing was added
     """
-    os.makedirs(settings.DOCS_DIRECTORY, exist_ok=True)
-    temp_path = os.path.join(settings.DOCS_DIRECTORY, filename)
+    client = get_async_client()
+    db = client[settings.MONGODB_DB_NAME]
+    collection = db[settings.MONGODB_COLLECTION_NAME]
     
-    # If content is provided, write it to the file
-    if content:
-        with open(temp_path, 'wb') as f:
-            f.write(content)
+    query = {} if filenames is None else {"filename": {"$in": list(filenames)}}
+    cursor = collection.find(query, {"filename": 1, "metadata.content_hash": 1, "_id": 0})
+    async for file in cursor:
+        yield file["filename"], file.get("metadata", {}).get("content_hash")
+
+async def mark_file_indexed_in_mongodb(filename, content_hash):
+    """Record that a version of a file is in the vector base"""
+    client = get_async_client()
+    db = client[settings.MONGODB_DB_NAME]
+    collection = db[settings.MONGODB_COLLECTION_NAME]
+    
+    await collection.update_one(
+        {"filename": filename},
+        {"$set": {"metadata.indexed_hash": content_hash, "metadata.indexed_at": datetime.utcnow()}}
+    )
+
+async def set_file_hash_in_mongodb(filename, content_hash):
+    """Store the content hash of a file"""
+    client = get_async_client()
+    db = client[settings.MONGODB_DB_NAME]
+    collection = db[settings.MONGODB_COLLECTION_NAME]
     
-    return temp_path 
\ No newline at end of file
+    await collection.update_one(
+        {"filename": filename},
+        {"$set": {"metadata.content_hash": content_hash}}
+    )
@@ -0,0 +1,237 @@
+import os
+import time
+import asyncio
+import getpass
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv, find_dotenv
+from langchain.prompts import PromptTemplate
+from langchain_gigachat import GigaChat
+
+from config import settings
+from core.metrics import RAG_STAGE_DURATION, RAG_PROMPT_TOKENS, RAG_FALLBACKS
+from core.tracing import span
+from services.answer_cache import answer_cache
+from services.retrieval import RetrievalOptions, build_context, estimate_tokens
+from services.embeddings import (
+    get_embeddings, get_collection_provider, EmbeddingProviderUnavailable, PROVIDER_LOCAL
+)
+from services.vector_store import open_vector_store
+
+PROMPT_TEMPLATE = """ Не используй markdown. Используй только следующий контекст для ответа на вопрос. Если ты не можешь найти ответ в контексте, прямо скажи "Я не могу найти ответ в предоставленных документах".
+        В ответе не должно быть ничего лишнего, только ответ на вопрос без дополнительных указаний.
+
+    Контекст:
+    {context}
+
+    Вопрос: {question}
+    Ответ: """
+
+PROMPT = PromptTemplate(
+    template=PROMPT_TEMPLATE, input_variables=["context", "question"]
+)
+
+@contextmanager
+def _stage(name, current=True, **attributes):
+    """Time one stage of answering a question and trace it as a span"""
+    started = time.perf_counter()
+    with span(f"rag.{name}", current=current, **attributes) as active:
+        try:
+            yield active
+        finally:
+            RAG_STAGE_DURATION.labels(name).observe(time.perf_counter() - started)
+
+
+def _record_prompt_tokens(prompt, message=None):
+    usage = getattr(message, "usage_metadata", None) if message is not None else None
+    tokens = usage.get("input_tokens") if usage else None
+    RAG_PROMPT_TOKENS.observe(tokens if tokens else estimate_tokens(prompt))
+
+
+# Chroma queries are synchronous, so they run here instead of on the event loop
+_search_executor = ThreadPoolExecutor(
+    max_workers=settings.RAG_SEARCH_WORKERS,
+    thread_name_prefix="rag-search"
+)
+
+
+class RetrievalEngine:
+    """
+    Long-lived set of RAG objects (embeddings, Chroma handle, LLM client)
+    shared by all chat requests. It is never mutated after construction:
+    a rebuild of the vector base produces a new engine that replaces this one.
+    """
+
+    def __init__(self, llm):
+        # Queries must be embedded by the same provider that built the index
+        self.provider = get_collection_provider(open_vector_store(None))
+        self.embeddings = get_embeddings(self.provider)
+        self.llm = llm
+        self.db = open_vector_store(self.embeddings)
+
+    def _search(self, query_vector, options):
+        # Embeddings are fetched too: MMR compares the candidates with each other
+        result = self.db._collection.query(
+            query_embeddings=[query_vector],
+            n_results=options.candidates,
+            include=["documents", "metadatas", "embeddings"]
+        )
+        return build_context(query_vector, result, options)
+
+    async def search_by_vector(self, query_vector, options=None):
+        """Return the context passages for an embedded question, most relevant first"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            _search_executor, self._search, query_vector, options or RetrievalOptions()
+        )
+
+    async def _retrieve(self, question, k=None):
+        """
+        Cache lookups and retrieval shared by aask and astream.
+        Returns (cached answer, None) on a cache hit and (None, context) otherwise.
+        """
+        # Cached answers were built from the default context, so a custom k bypasses the cache
+        use_cache = settings.ANSWER_CACHE_ENABLED and k is None
+        generation = None
+        if use_cache:
+            cached = answer_cache.get(question)
+            if cached is not None:
+                return cached, None
+            generation = answer_cache.generation
+
+        if self.provider == PROVIDER_LOCAL:
+            # The index was built by the fallback model
+            RAG_FALLBACKS.labels("local_embeddings").inc()
+        try:
+            with _stage("embed_query", provider=self.provider):
+                query_vector = await self.embeddings.aembed_query(question)
+        except EmbeddingProviderUnavailable:
+            RAG_FALLBACKS.labels("provider_unavailable").inc()
+            raise
+        if use_cache:
+            cached = answer_cache.get_similar(query_vector)
+            if cached is not None:
+                return cached, None
+            answer_cache.record_miss()
+
+        with _stage("vector_search") as active:
+            source_documents = await self.search_by_vector(query_vector, RetrievalOptions(k=k))
+            if active is not None:
+                active.set_attribute("rag.chunks", len(source_documents))
+        if not source_documents:
+            RAG_FALLBACKS.labels("empty_context").inc()
+        return None, RetrievalContext(question, query_vector, source_documents, generation)
+
+    def _remember(self, context, result):
+        answer = {"result": result, "source_documents": context.source_documents}
+        if context.generation is not None:
+            answer_cache.put(context.question, answer, context.query_vector, context.generation)
+        return answer
+
+    async def aask(self, question, k=None):
+        """Answer a question; returns the answer text with its source documents"""
+        with span("rag.ask"):
+            cached, context = await self._retrieve(question, k)
+            if cached is not None:
+                return cached
+            prompt = context.prompt()
+            with _stage("llm"):
+                message = await self.llm.ainvoke(prompt)
+            _record_prompt_tokens(prompt, message)
+            return self._remember(context, message.content)
+
+    async def astream(self, question, k=None):
+        """
+        Answer a question token by token.
+        Yields ("token", text) events followed by a single ("sources", documents) event.
+        """
+        # Spans are not made current here: the generator is resumed between events
+        with span("rag.stream", current=False):
+            cached, context = await self._retrieve(question, k)
+            if cached is not None:
+                yield "token", cached["result"]
+                yield "sources", cached["source_documents"]
+                return
+            prompt = context.prompt()
+            _record_prompt_tokens(prompt)
+            tokens = []
+            started = time.perf_counter()
+            with _stage("llm", current=False):
+                async for chunk in self.llm.astream(prompt):
+                    if chunk.content:
+                        if not tokens:
+                            RAG_STAGE_DURATION.labels("llm_first_token").observe(time.perf_counter() - started)
+                        tokens.append(chunk.content)
+                        yield "token", chunk.content
+            self._remember(context, "".join(tokens))
+            yield "sources", context.source_documents
+
+
+class RetrievalContext:
+    """Result of the retrieval step for a question that missed the cache"""
+
+    def __init__(self, question, query_vector, source_documents, generation):
+        self.question = question
+        self.query_vector = query_vector
+        self.source_documents = source_documents
+        self.generation = generation
+
+    def prompt(self):
+        context = "\n\n".join(doc.page_content for doc in self.source_documents)
+        return PROMPT.format(context=context, question=self.question)
+
+
+# Singleton engine
+_llm = None
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def _get_llm():
+    """Get or create the GigaChat client"""
+    global _llm
+    if _llm is None:
+        load_dotenv(find_dotenv())
+        if "GIGACHAT_CREDENTIALS" not in os.environ:
+            os.environ["GIGACHAT_CREDENTIALS"] = getpass.getpass("Введите ключ авторизации GigaChat API: ")
+        _llm = GigaChat(verify_ssl_certs=False)
+    return _llm
+
+
+def get_retrieval_engine():
+    """Get or lazily create the shared retrieval engine"""
+    global _engine
+    engine = _engine
+    if engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = RetrievalEngine(_get_llm())
+            engine = _engine
+    return engine
+
+
+async def aget_retrieval_engine():
+    """Same as get_retrieval_engine, but a first-time build (which may load a local model) runs off the event loop"""
+    engine = _engine
+    if engine is None:
+        engine = await asyncio.to_thread(get_retrieval_engine)
+    return engine
+
+
+def has_retrieval_engine():
+    """Whether the engine has been built in this process"""
+    return _engine is not None
+
+
+def reload_retrieval_engine():
+    """
+    Rebuild the engine against the current live collection and swap it in.
+    Requests already holding the old engine finish on it undisturbed.
+    """
+    global _engine
+    engine = RetrievalEngine(_get_llm())
+    with _engine_lock:
+        _engine = engine
+    return engine
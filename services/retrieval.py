@@ -0,0 +1,197 @@
+import hashlib
+
+import numpy as np
+from langchain_core.documents import Document
+
+from config import settings
+from core.metrics import RAG_RETRIEVED_CHUNKS, RAG_CONTEXT_CHUNKS, RAG_CONTEXT_TOKENS, RAG_CONTEXT_DROPPED
+
+SEARCH_SIMILARITY = "similarity"
+SEARCH_MMR = "mmr"
+
+# Rough size of a token for prompts where the LLM does not report usage
+CHARS_PER_TOKEN = 3
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+class RetrievalOptions:
+    """Retrieval settings for one question; defaults come from the RAG_* settings"""
+
+    def __init__(self, k=None, search_type=None, fetch_k=None, mmr_lambda=None,
+                 score_threshold=None, token_budget=None):
+        self.k = k or settings.RAG_TOP_K
+        self.search_type = search_type or settings.RAG_SEARCH_TYPE
+        self.fetch_k = max(self.k, fetch_k or settings.RAG_FETCH_K)
+        self.mmr_lambda = settings.RAG_MMR_LAMBDA if mmr_lambda is None else mmr_lambda
+        self.score_threshold = settings.RAG_SCORE_THRESHOLD if score_threshold is None else score_threshold
+        self.token_budget = settings.RAG_CONTEXT_TOKEN_BUDGET if token_budget is None else token_budget
+
+    @property
+    def candidates(self):
+        """How many nearest chunks to fetch before re-ranking"""
+        return self.fetch_k if self.search_type == SEARCH_MMR else self.k
+
+
+def _unit_rows(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+
+def mmr_select(query_similarities, candidate_vectors, k, mmr_lambda):
+    """
+    Maximal marginal relevance: greedily pick chunks similar to the question
+    but dissimilar to the chunks already picked. Returns candidate indexes.
+    """
+    if not len(query_similarities):
+        return []
+    pairwise = candidate_vectors @ candidate_vectors.T
+    selected = [int(np.argmax(query_similarities))]
+    redundancy = pairwise[selected[0]].copy()
+    while len(selected) < min(k, len(query_similarities)):
+        scores = mmr_lambda * query_similarities - (1 - mmr_lambda) * redundancy
+        scores[selected] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        redundancy = np.maximum(redundancy, pairwise[best])
+    return selected
+
+
+def rank_candidates(query_vector, result, options):
+    """
+    Turn a raw Chroma query result into ranked documents: drop chunks under the
+    score threshold and re-rank by MMR when configured. The cosine similarity to
+    the question is kept in metadata["score"].
+    """
+    texts = result["documents"][0]
+    if not texts:
+        return []
+    metadatas = result["metadatas"][0]
+    vectors = _unit_rows(result["embeddings"][0])
+    similarities = vectors @ _unit_rows(query_vector)
+
+    keep = np.arange(len(texts))
+    if options.score_threshold is not None:
+        keep = keep[similarities >= options.score_threshold]
+        dropped = len(texts) - len(keep)
+        if dropped:
+            RAG_CONTEXT_DROPPED.labels("score_threshold").inc(dropped)
+    if options.search_type == SEARCH_MMR:
+        order = [keep[i] for i in mmr_select(similarities[keep], vectors[keep], options.k, options.mmr_lambda)]
+    else:
+        order = keep[np.argsort(-similarities[keep], kind="stable")][:options.k]
+
+    return [
+        Document(
+            page_content=texts[i],
+            metadata={**(metadatas[i] or {}), "score": round(float(similarities[i]), 4)}
+        )
+        for i in order
+    ]
+
+
+def _overlap(left, right):
+    """
+    Characters that right repeats from the end of left, taken from the offsets the
+    splitter recorded. Chunks of different pages, or indexed before offsets were
+    stored, are never assumed to overlap.
+    """
+    left_start = left.metadata.get("start_index")
+    right_start = right.metadata.get("start_index")
+    if left_start is None or right_start is None:
+        return 0
+    if left.metadata.get("page_index") != right.metadata.get("page_index"):
+        return 0
+    size = left_start + len(left.page_content) - right_start
+    if size <= 0 or right_start < left_start or not left.page_content.endswith(right.page_content[:size]):
+        return 0
+    return size
+
+
+def _join(left_text, right_text, overlap):
+    if overlap:
+        return left_text + right_text[overlap:]
+    return left_text + "\n" + right_text
+
+
+def deduplicate_chunks(documents):
+    """
+    Remove repeated text from the context: identical chunks (the same text in
+    several files) are dropped, and neighbouring chunks of one file are joined,
+    without the overlap the splitter copied into both where there is one.
+    Relevance order is kept; a merged passage takes the place of its best chunk.
+    """
+    passages = []
+    seen_texts = set()
+    # (filename, chunk_index) -> (passage holding that chunk, the chunk itself)
+    by_position = {}
+    for document in documents:
+        digest = hashlib.sha256(" ".join(document.page_content.split()).encode("utf-8")).digest()
+        if digest in seen_texts:
+            RAG_CONTEXT_DROPPED.labels("duplicate").inc()
+            continue
+        seen_texts.add(digest)
+
+        filename = document.metadata.get("filename")
+        index = document.metadata.get("chunk_index")
+        if filename is None or index is None:
+            passages.append(document)
+            continue
+
+        previous = by_position.get((filename, index - 1))
+        following = by_position.get((filename, index + 1))
+        if previous is not None:
+            target, chunk = previous
+            target.page_content = _join(target.page_content, document.page_content, _overlap(chunk, document))
+        elif following is not None:
+            target, chunk = following
+            target.page_content = _join(document.page_content, target.page_content, _overlap(document, chunk))
+        else:
+            target = Document(page_content=document.page_content, metadata=dict(document.metadata))
+            passages.append(target)
+            by_position[(filename, index)] = (target, document)
+            continue
+        by_position[(filename, index)] = (target, document)
+        # A chunk next to two passages joins only the earlier one: the later passage keeps its overlap
+        RAG_CONTEXT_DROPPED.labels("merged").inc()
+        target.metadata.setdefault("chunk_indexes", [target.metadata.get("chunk_index")])
+        target.metadata["chunk_indexes"].append(index)
+    return passages
+
+
+def fit_token_budget(documents, budget):
+    """
+    Keep the most relevant passages that fit into the token budget.
+    The first passage is always kept, cut to the budget if it alone is too long.
+    """
+    if not budget:
+        return documents
+    kept = []
+    used = 0
+    for document in documents:
+        tokens = estimate_tokens(document.page_content)
+        if used + tokens > budget:
+            if not kept:
+                document.page_content = document.page_content[:budget * CHARS_PER_TOKEN]
+                kept.append(document)
+            RAG_CONTEXT_DROPPED.labels("token_budget").inc(len(documents) - len(kept))
+            break
+        kept.append(document)
+        used += tokens
+    return kept
+
+
+def build_context(query_vector, result, options):
+    """Documents that go into the prompt, with metrics on what is actually sent"""
+    RAG_RETRIEVED_CHUNKS.observe(len(result["documents"][0]))
+    documents = fit_token_budget(
+        deduplicate_chunks(rank_candidates(query_vector, result, options)),
+        options.token_budget
+    )
+    RAG_CONTEXT_CHUNKS.observe(len(documents))
+    RAG_CONTEXT_TOKENS.observe(sum(estimate_tokens(document.page_content) for document in documents))
+    return documents
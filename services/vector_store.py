@@ -0,0 +1,77 @@
+import threading
+
+import chromadb
+from chromadb.config import Settings
+from langchain_chroma import Chroma
+
+from config import settings
+
+# Store the vector database in MongoDB or local directory based on settings
+db_path = settings.CHROMA_DB_PATH if not settings.USE_MONGODB else None
+
+# Live collection queried by /chat/ask
+COLLECTION_NAME = "RAG"
+# Full rebuilds are written here and promoted once complete
+STAGING_COLLECTION_NAME = f"{COLLECTION_NAME}_next"
+# Previous live collection, kept until the next rebuild so in-flight queries can finish
+RETIRED_COLLECTION_NAME = f"{COLLECTION_NAME}_prev"
+
+
+_server_client = None
+_server_client_lock = threading.Lock()
+
+
+def _get_server_client():
+    """Shared client for a Chroma server, used when API and indexing worker are separate processes"""
+    global _server_client
+    with _server_client_lock:
+        if _server_client is None:
+            _server_client = chromadb.HttpClient(
+                host=settings.CHROMA_SERVER_HOST,
+                port=settings.CHROMA_SERVER_PORT,
+                settings=Settings(anonymized_telemetry=False)
+            )
+        return _server_client
+
+
+def open_vector_store(embeddings, collection_name=COLLECTION_NAME, collection_metadata=None):
+    """Open a LangChain handle for a Chroma collection, creating it if needed"""
+    if settings.CHROMA_SERVER_HOST:
+        return Chroma(
+            collection_name=collection_name,
+            embedding_function=embeddings,
+            collection_metadata=collection_metadata,
+            client=_get_server_client()
+        )
+    return Chroma(
+        collection_name=collection_name,
+        embedding_function=embeddings,
+        collection_metadata=collection_metadata,
+        client_settings=Settings(anonymized_telemetry=False),
+        persist_directory=db_path
+    )
+
+
+def drop_collection(db, collection_name):
+    """Delete a collection if it exists"""
+    try:
+        db._client.delete_collection(collection_name)
+    except Exception:
+        pass
+
+
+def promote_staging_collection(db):
+    """
+    Make the staging collection the live one.
+    Handles opened on the old live collection keep working because Chroma
+    addresses collections by id, so the old one is only renamed here and
+    dropped at the start of the next rebuild.
+    """
+    client = db._client
+    drop_collection(db, RETIRED_COLLECTION_NAME)
+    try:
+        client.get_collection(COLLECTION_NAME).modify(name=RETIRED_COLLECTION_NAME)
+    except Exception:
+        # First build: there is no live collection yet
+        pass
+    client.get_collection(STAGING_COLLECTION_NAME).modify(name=COLLECTION_NAME)
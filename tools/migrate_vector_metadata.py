@@ -0,0 +1,50 @@
+import os
+import sys
+
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.vector_store import open_vector_store, COLLECTION_NAME
+
+BATCH_SIZE = 1000
+
+
+def migrate_vector_metadata():
+    """
+    Add the normalized `filename` field to chunks indexed before it existed,
+    so per-file deletion can use a metadata filter instead of scanning the collection.
+    """
+    print(f"Starting migration of chunk metadata in collection '{COLLECTION_NAME}'...")
+    
+    collection = open_vector_store(None)._collection
+    total = collection.count()
+    if total == 0:
+        print("Collection is empty. Nothing to migrate.")
+        return
+    
+    print(f"Found {total} chunks to check.")
+    
+    migrated_count = 0
+    # Updates do not change the number of rows, so paging by offset is stable
+    for offset in range(0, total, BATCH_SIZE):
+        result = collection.get(limit=BATCH_SIZE, offset=offset, include=["metadatas"])
+        ids = []
+        metadatas = []
+        for chunk_id, metadata in zip(result["ids"], result["metadatas"]):
+            if not metadata or "filename" in metadata or "source" not in metadata:
+                continue
+            # Sources may be Windows paths ("Docs\\file.pdf") regardless of the current OS
+            source = metadata["source"].replace("\\", "/")
+            ids.append(chunk_id)
+            metadatas.append({**metadata, "filename": os.path.basename(source)})
+        if ids:
+            collection.update(ids=ids, metadatas=metadatas)
+            migrated_count += len(ids)
+        print(f"[{min(offset + BATCH_SIZE, total)}/{total}] checked")
+    
+    print("\nMigration complete!")
+    print(f"Chunks updated: {migrated_count}")
+    print("\nThe collection still predates content hashes, so the next /documents/update-base runs a full rebuild")
+
+if __name__ == "__main__":
+    migrate_vector_metadata()